@@ -0,0 +1,35 @@
+"""
+shared helpers for the benchmark scripts
+"""
+
+import os
+import time
+from typing import Awaitable, Callable
+
+from sftkit.database import DatabaseConfig
+
+
+def db_config() -> DatabaseConfig:
+    return DatabaseConfig(
+        host=os.environ.get("SFTKIT_TEST_DB_HOST"),
+        port=int(os.environ.get("SFTKIT_TEST_DB_PORT", "5432")),
+        user=os.environ.get("SFTKIT_TEST_DB_USER"),
+        password=os.environ.get("SFTKIT_TEST_DB_PASSWORD"),
+        dbname=os.environ.get("SFTKIT_TEST_DB_DBNAME", "sftkit_test"),
+    )
+
+
+async def best_of(func: Callable[[], Awaitable], repeat: int = 5) -> float:
+    """run the given coroutine function `repeat` times and return the fastest run time in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def print_table(header: list[str], rows: list[list]):
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    for row in [header, *rows]:
+        print("  ".join(str(x).rjust(w) for x, w in zip(row, widths)))
@@ -0,0 +1,70 @@
+"""
+Compare time and peak python memory of aggregating numeric columns via fetch_many and via fetch_columns.
+"""
+
+import asyncio
+import time
+import tracemalloc
+
+from _common import db_config, print_table
+from pydantic import BaseModel
+
+from sftkit.database import Connection, create_db_pool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+BUCKET_THRESHOLD = 50
+QUERY = "select g as id, g % 100 as bucket, random() as value from generate_series(1, $1) as g"
+
+
+class Row(BaseModel):
+    id: int
+    bucket: int
+    value: float
+
+
+async def via_models(conn: Connection, n_rows: int) -> float:
+    rows = await conn.fetch_many(Row, QUERY, n_rows)
+    return sum(r.value for r in rows if r.bucket < BUCKET_THRESHOLD)
+
+
+async def via_columns(conn: Connection, n_rows: int, use_numpy: bool) -> float:
+    columns = await conn.fetch_columns(QUERY, n_rows, use_numpy=use_numpy)
+    if use_numpy:
+        return float(columns["value"][columns["bucket"] < BUCKET_THRESHOLD].sum())
+    return sum(v for b, v in zip(columns["bucket"], columns["value"]) if b < BUCKET_THRESHOLD)
+
+
+async def measure(func) -> tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    await func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=1)
+    rows = []
+    async with pool.acquire() as conn:
+        for n_rows in (100_000, 1_000_000):
+            variants = [
+                ("fetch_many", lambda: via_models(conn, n_rows)),
+                ("fetch_columns (array)", lambda: via_columns(conn, n_rows, use_numpy=False)),
+            ]
+            if numpy is not None:
+                variants.append(("fetch_columns (numpy)", lambda: via_columns(conn, n_rows, use_numpy=True)))
+            for name, func in variants:
+                elapsed, peak = await measure(func)
+                rows.append([n_rows, name, f"{elapsed:.2f}", f"{peak / 2**20:.1f}", f"{peak / n_rows:.0f}"])
+    await pool.close()
+    print_table(["rows", "method", "seconds", "peak MiB", "peak bytes/row"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
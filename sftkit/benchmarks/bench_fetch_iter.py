@@ -0,0 +1,50 @@
+"""
+Compare peak python memory usage of Connection.fetch_many and Connection.fetch_iter for growing result sets.
+"""
+
+import asyncio
+import tracemalloc
+
+from _common import db_config, print_table
+from pydantic import BaseModel
+
+from sftkit.database import Connection, create_db_pool
+
+QUERY = "select g as id, md5(g::text) as name, g * 0.5 as value from generate_series(1, $1) as g"
+
+
+class Row(BaseModel):
+    id: int
+    name: str
+    value: float
+
+
+async def _peak_memory(conn: Connection, n_rows: int, use_iter: bool) -> int:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    if use_iter:
+        async with conn.fetch_iter(Row, QUERY, n_rows, prefetch=1000) as cursor:
+            async for _ in cursor:
+                pass
+    else:
+        for _ in await conn.fetch_many(Row, QUERY, n_rows):
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=1)
+    rows = []
+    async with pool.acquire() as conn:
+        for n_rows in (10_000, 100_000, 1_000_000):
+            many = await _peak_memory(conn, n_rows, use_iter=False)
+            streamed = await _peak_memory(conn, n_rows, use_iter=True)
+            rows.append([n_rows, f"{many / 2**20:.1f}", f"{streamed / 2**20:.1f}"])
+    await pool.close()
+    print_table(["rows", "fetch_many peak MiB", "fetch_iter peak MiB"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
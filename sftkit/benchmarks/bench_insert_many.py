@@ -0,0 +1,75 @@
+"""
+Compare insert throughput of row by row inserts, executemany and Connection.insert_many / upsert_many.
+"""
+
+import asyncio
+import time
+
+from _common import db_config, print_table
+from pydantic import BaseModel
+
+from sftkit.database import Connection, create_db_pool
+
+N_ROWS = 20_000
+
+
+class Measurement(BaseModel):
+    sensor: str
+    value: float
+    comment: str | None
+
+
+def measurements() -> list[Measurement]:
+    return [Measurement(sensor=f"sensor{i}", value=i * 0.5, comment=None) for i in range(N_ROWS)]
+
+
+async def row_by_row(conn: Connection, models: list[Measurement]):
+    for m in models:
+        await conn.execute(
+            "insert into bench_measurement (sensor, value, comment) values ($1, $2, $3)", m.sensor, m.value, m.comment
+        )
+
+
+async def execute_many(conn: Connection, models: list[Measurement]):
+    await conn.executemany(
+        "insert into bench_measurement (sensor, value, comment) values ($1, $2, $3)",
+        [(m.sensor, m.value, m.comment) for m in models],
+    )
+
+
+async def insert_many(conn: Connection, models: list[Measurement]):
+    await conn.insert_many("bench_measurement", models)
+
+
+async def upsert_many(conn: Connection, models: list[Measurement]):
+    await conn.upsert_many("bench_measurement", models, conflict_columns=["sensor"])
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=1)
+    rows = []
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "create temporary table bench_measurement (sensor text primary key, value float8 not null, comment text)"
+        )
+        for name, func in (
+            ("execute per row", row_by_row),
+            ("executemany", execute_many),
+            ("insert_many", insert_many),
+            ("upsert_many (insert)", upsert_many),
+            ("upsert_many (update)", upsert_many),
+        ):
+            if name != "upsert_many (update)":
+                await conn.execute("truncate bench_measurement")
+            models = measurements()
+            start = time.perf_counter()
+            async with conn.transaction():
+                await func(conn, models)
+            elapsed = time.perf_counter() - start
+            rows.append([name, N_ROWS, f"{elapsed:.2f}", f"{N_ROWS / elapsed:,.0f}"])
+    await pool.close()
+    print_table(["method", "rows", "seconds", "rows/s"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
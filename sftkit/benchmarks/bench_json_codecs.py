@@ -0,0 +1,72 @@
+"""
+Compare jsonb decode throughput of the available json codecs in text and binary wire format.
+"""
+
+import asyncio
+
+from _common import best_of, db_config, print_table
+
+from sftkit.database import create_db_pool
+from sftkit.database._json import get_json_codec
+
+N_ROWS = 200
+# a jsonb document of roughly 150 KiB
+DOCUMENT_QUERY = (
+    "select jsonb_agg(jsonb_build_object('id', g, 'name', md5(g::text), 'tags', jsonb_build_array('a', 'b', g), "
+    "'value', g * 0.25, 'active', g % 2 = 0)) from generate_series(1, 1500) as g"
+)
+
+
+async def bench(codec: str, binary: bool) -> list | None:
+    cfg = db_config().model_copy(update={"json_codec": codec, "json_binary_format": binary})
+    try:
+        pool = await create_db_pool(cfg, n_connections=1)
+    except ImportError:
+        return None
+
+    async with pool.acquire() as conn:
+        document = await conn.fetchval(DOCUMENT_QUERY)
+        await conn.execute("create temporary table bench_json (doc jsonb not null)")
+        await conn.executemany("insert into bench_json (doc) values ($1)", [(document,)] * N_ROWS)
+        size = await conn.fetchval("select sum(octet_length(doc::text)) from bench_json")
+
+        async def fetch():
+            await conn.fetch("select doc from bench_json")
+
+        elapsed = await best_of(fetch)
+        raw = await conn.fetchval("select doc::text from bench_json limit 1")
+    await pool.close()
+
+    json_codec = get_json_codec(codec)  # type: ignore[arg-type]
+    encoded = raw.encode("utf-8")
+    if binary:
+        encoded = b"\x01" + encoded
+
+    async def decode():
+        for _ in range(N_ROWS):
+            if binary:
+                json_codec.decode_jsonb_binary(encoded)
+            else:
+                json_codec.decode_text(raw)
+
+    decode_elapsed = await best_of(decode)
+    return [
+        codec,
+        "binary" if binary else "text",
+        f"{size / elapsed / 2**20:.1f}",
+        f"{size / decode_elapsed / 2**20:.1f}",
+    ]
+
+
+async def main():
+    rows = []
+    for codec in ("json", "orjson", "msgspec"):
+        for binary in (False, True):
+            row = await bench(codec, binary)
+            if row is not None:
+                rows.append(row)
+    print_table(["codec", "format", "fetch MiB/s", "decode only MiB/s"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Load test comparing a fixed size pool with an elastic one.
+
+Both pools serve the same concurrent workload, afterwards the number of backends still held by each pool is
+measured once idle connections have been reaped.
+"""
+
+import asyncio
+import time
+
+import asyncpg
+from _common import db_config, print_table
+
+from sftkit.database import create_db_pool
+
+N_CONNECTIONS = 20
+N_WORKERS = 50
+LOAD_DURATION = 5.0
+IDLE_TIME = 1.0
+
+
+async def count_backends(cfg) -> int:
+    """number of other client backends connected to the benchmark database"""
+    conn = await asyncpg.connect(
+        user=cfg.user, password=cfg.password, host=cfg.host, port=cfg.port, database=cfg.dbname
+    )
+    try:
+        return await conn.fetchval(
+            "select count(*) from pg_stat_activity "
+            "where datname = current_database() and backend_type = 'client backend' and pid <> pg_backend_pid()"
+        )
+    finally:
+        await conn.close()
+
+
+async def bench(min_connections: int | None) -> list:
+    cfg = db_config().model_copy(update={"min_connections": min_connections, "max_idle_time": IDLE_TIME})
+    pool = await create_db_pool(cfg, n_connections=N_CONNECTIONS)
+    queries = 0
+    deadline = time.perf_counter() + LOAD_DURATION
+
+    async def worker():
+        nonlocal queries
+        while time.perf_counter() < deadline:
+            async with pool.acquire() as conn:
+                await conn.fetchval("select count(*) from generate_series(1, 1000)")
+            queries += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(N_WORKERS)))
+    throughput = queries / (time.perf_counter() - start)
+    busy_backends = await count_backends(cfg)
+
+    await asyncio.sleep(IDLE_TIME * 3)
+    idle_backends = await count_backends(cfg)
+    await pool.close()
+    return [
+        "fixed" if min_connections is None else f"elastic (min={min_connections})",
+        f"{throughput:.0f}",
+        busy_backends,
+        idle_backends,
+    ]
+
+
+async def main():
+    rows = [await bench(min_connections=None), await bench(min_connections=2)]
+    print_table(["pool", "queries/s", "backends under load", "backends when idle"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+"""
+Measure the per statement overhead of collecting query statistics.
+"""
+
+import asyncio
+
+from _common import best_of, db_config, print_table
+
+from sftkit.database import create_db_pool
+
+N_QUERIES = 5000
+
+
+async def bench(collect_query_statistics: bool) -> float:
+    cfg = db_config().model_copy(update={"collect_query_statistics": collect_query_statistics})
+    pool = await create_db_pool(cfg, n_connections=1)
+    async with pool.acquire() as conn:
+
+        async def run():
+            for i in range(N_QUERIES):
+                await conn.fetchval("select $1::int", i)
+
+        elapsed = await best_of(run)
+    await pool.close()
+    return elapsed / N_QUERIES
+
+
+async def main():
+    baseline = await bench(collect_query_statistics=False)
+    instrumented = await bench(collect_query_statistics=True)
+    print_table(
+        ["statistics", "us/query", "overhead us/query"],
+        [
+            ["off", f"{baseline * 1e6:.1f}", "-"],
+            ["on", f"{instrumented * 1e6:.1f}", f"{(instrumented - baseline) * 1e6:.1f}"],
+        ],
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
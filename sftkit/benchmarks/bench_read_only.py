@@ -0,0 +1,89 @@
+"""
+Compare the read only transaction modes of service methods under concurrent write load.
+
+Writers move amounts between accounts in serializable transactions while readers sum up all balances, the
+reported throughput shows how the read only modes affect readers and writers alike.
+"""
+
+import asyncio
+import time
+
+from _common import db_config, print_table
+
+from sftkit.database import Connection, create_db_pool
+from sftkit.retry import RetryPolicy, RetryStatistics
+from sftkit.service import Service, with_db_transaction
+
+N_ACCOUNTS = 1000
+N_WRITERS = 8
+N_READERS = 8
+DURATION = 5.0
+
+
+class AccountService(Service):
+    @with_db_transaction
+    async def transfer(self, *, conn: Connection, source: int, target: int):
+        await conn.execute("update bench_account set balance = balance - 1 where id = $1", source)
+        await conn.execute("update bench_account set balance = balance + 1 where id = $1", target)
+
+    @with_db_transaction(read_only=True)
+    async def total_read_committed(self, *, conn: Connection) -> int:
+        return await conn.fetchval("select sum(balance) from bench_account")
+
+    @with_db_transaction
+    async def total_serializable(self, *, conn: Connection) -> int:
+        return await conn.fetchval("select sum(balance) from bench_account")
+
+    @with_db_transaction(read_only=True, read_only_mode="snapshot")
+    async def total_snapshot(self, *, conn: Connection) -> int:
+        return await conn.fetchval("select sum(balance) from bench_account")
+
+    @with_db_transaction(read_only=True, read_only_mode="serializable")
+    async def total_deferrable(self, *, conn: Connection) -> int:
+        return await conn.fetchval("select sum(balance) from bench_account")
+
+
+async def bench(service: AccountService, mode: str) -> list:
+    await service.db_pool.execute("update bench_account set balance = 100")
+    service.retry_policy.statistics.reset()
+    read = getattr(service, f"total_{mode}")
+    deadline = time.perf_counter() + DURATION
+    reads = 0
+    writes = 0
+    inconsistent = 0
+
+    async def writer(i: int):
+        nonlocal writes
+        while time.perf_counter() < deadline:
+            source = (i * 7919 + writes) % N_ACCOUNTS + 1
+            await service.transfer(source=source, target=source % N_ACCOUNTS + 1)  # type: ignore[call-arg]
+            writes += 1
+
+    async def reader():
+        nonlocal reads, inconsistent
+        while time.perf_counter() < deadline:
+            if await read() != N_ACCOUNTS * 100:
+                inconsistent += 1
+            reads += 1
+
+    await asyncio.gather(*(writer(i) for i in range(N_WRITERS)), *(reader() for _ in range(N_READERS)))
+    retries = sum(s.retries for s in service.retry_policy.statistics.snapshot())
+    return [mode, f"{reads / DURATION:.0f}", f"{writes / DURATION:.0f}", retries, inconsistent]
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=N_WRITERS + N_READERS)
+    await pool.execute("drop table if exists bench_account")
+    await pool.execute("create table bench_account (id bigint primary key, balance bigint not null)")
+    await pool.execute("insert into bench_account select g, 100 from generate_series(1, $1::int) g", N_ACCOUNTS)
+    policy = RetryPolicy(max_attempts=100, statistics=RetryStatistics())
+    service = AccountService(db_pool=pool, config=None, retry_policy=policy)
+
+    rows = [await bench(service, mode) for mode in ["read_committed", "serializable", "snapshot", "deferrable"]]
+    await pool.execute("drop table bench_account")
+    await pool.close()
+    print_table(["read mode", "reads/s", "writes/s", "retries", "inconsistent reads"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
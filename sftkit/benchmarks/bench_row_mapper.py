@@ -0,0 +1,64 @@
+"""
+Compare the cost of converting fetched records into pydantic models:
+the previous per row `model_validate(dict(record))`, the cached row mapper and the trusted row mapper.
+"""
+
+import asyncio
+
+from _common import best_of, db_config, print_table
+from pydantic import BaseModel
+
+from sftkit.database import Connection, create_db_pool
+from sftkit.database._mapper import ModelRecord, get_row_mapper
+
+QUERY = (
+    "select g as id, md5(g::text) as name, g % 2 = 0 as is_even, null::text as comment from generate_series(1, $1) as g"
+)
+
+
+class Row(BaseModel):
+    id: int
+    name: str
+    is_even: bool
+    comment: str | None
+
+
+async def bench(conn: Connection, n_rows: int) -> list:
+    records = await conn.fetch(QUERY, n_rows, record_class=ModelRecord)
+    columns = tuple(records[0].keys())
+
+    async def per_row():
+        [Row.model_validate(dict(r)) for r in records]
+
+    async def mapper():
+        get_row_mapper(Row, columns).map_many(records)
+
+    async def trusted():
+        get_row_mapper(Row, columns, trusted=True).map_many(records)
+
+    baseline = await best_of(per_row)
+    mapped = await best_of(mapper)
+    constructed = await best_of(trusted)
+    return [
+        n_rows,
+        f"{baseline * 1000:.1f}",
+        f"{mapped * 1000:.1f} ({baseline / mapped:.1f}x)",
+        f"{constructed * 1000:.1f} ({baseline / constructed:.1f}x)",
+        f"{mapped / constructed:.1f}x",
+    ]
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=1)
+    rows = []
+    async with pool.acquire() as conn:
+        for n_rows in (1_000, 10_000, 100_000):
+            rows.append(await bench(conn, n_rows))
+    await pool.close()
+    print_table(
+        ["rows", "model_validate(dict(r)) ms", "row mapper ms", "trusted row mapper ms", "trusted vs row mapper"], rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
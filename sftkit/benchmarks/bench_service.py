@@ -0,0 +1,71 @@
+"""
+Measure the per call overhead of the service decorators.
+
+"passthrough" calls a decorated method with an explicit connection, which only exercises the wrapper itself,
+"transaction" acquires a connection and opens a transaction per call and is compared with doing so by hand.
+"""
+
+import asyncio
+
+from _common import best_of, db_config, print_table
+
+from sftkit.database import Connection, create_db_pool
+from sftkit.service import Service, with_db_connection, with_db_transaction
+
+N_CALLS = 20000
+N_DB_CALLS = 2000
+
+
+class BenchService(Service):
+    async def plain(self, *, conn: Connection) -> None:
+        del conn
+
+    @with_db_connection
+    async def connection(self, *, conn: Connection) -> None:
+        del conn
+
+    @with_db_transaction
+    async def transaction(self, *, conn: Connection) -> None:
+        del conn
+
+    @with_db_transaction(read_only=True)
+    async def read_only(self, *, conn: Connection, __read_only__: bool) -> None:
+        del conn, __read_only__
+
+
+async def per_call(func, n_calls: int) -> float:
+    async def run():
+        for _ in range(n_calls):
+            await func()
+
+    return await best_of(run) / n_calls
+
+
+async def main():
+    pool = await create_db_pool(db_config(), n_connections=1)
+    service = BenchService(db_pool=pool, config=None)
+    conn = object()
+
+    plain = await per_call(lambda: service.plain(conn=conn), N_CALLS)  # type: ignore[arg-type]
+    rows = [["undecorated", f"{plain * 1e6:.2f}", "-"]]
+    for name in ["connection", "transaction", "read_only"]:
+        method = getattr(service, name)
+        elapsed = await per_call(lambda: method(conn=conn), N_CALLS)  # pylint: disable=cell-var-from-loop
+        rows.append([f"{name} passthrough", f"{elapsed * 1e6:.2f}", f"{(elapsed - plain) * 1e6:.2f}"])
+
+    async def by_hand():
+        async with pool.acquire() as c:
+            async with c.transaction(isolation="serializable"):
+                await service.plain(conn=c)
+
+    manual = await per_call(by_hand, N_DB_CALLS)
+    rows.append(["acquire + transaction by hand", f"{manual * 1e6:.2f}", "-"])
+    decorated = await per_call(service.transaction, N_DB_CALLS)  # type: ignore[arg-type]
+    rows.append(["transaction", f"{decorated * 1e6:.2f}", f"{(decorated - manual) * 1e6:.2f}"])
+    await pool.close()
+
+    print_table(["call", "us/call", "overhead us/call"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+in process result caches of service methods, invalidated through postgres notifications
+"""
+
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Concatenate, Hashable, ParamSpec, Sequence, TypeVar
+
+from sftkit.database import Connection, Pool, current_scope
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+S = TypeVar("S")
+P = ParamSpec("P")
+
+
+class ResultCache:
+    """
+    LRU cache holding at most `max_size` entries, each for at most `ttl` seconds (forever if None).
+    """
+
+    def __init__(self, name: str, max_size: int = 1024, ttl: float | None = None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least one")
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # incremented by every clear, values computed before a clear must not be stored afterwards
+        self.generation = 0
+        # key -> (expiry time, value), the least recently used entry comes first
+        self._entries: collections.OrderedDict[Hashable, tuple[float, Any]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """returns whether the key has been found and its value"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, key: Hashable, value: Any, generation: int | None = None):
+        """store the value unless the cache has been cleared since `generation` was read"""
+        if generation is not None and generation != self.generation:
+            return
+        expires_at = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+# caches of all cached methods by the notification channel invalidating them
+_caches_by_channel: dict[str, list[ResultCache]] = collections.defaultdict(list)
+
+
+def cached(
+    ttl: float | None = None,
+    invalidate_on: str | Sequence[str] = (),
+    max_size: int = 1024,
+) -> Callable[[Callable[Concatenate[S, P], Awaitable[R]]], Callable[Concatenate[S, P], Awaitable[R]]]:
+    """
+    Cache the results of a read only service method in process, keyed by the service instance and the arguments.
+
+    Entries expire after `ttl` seconds, at most `max_size` entries are kept. All entries are dropped whenever a
+    notification is sent on one of the `invalidate_on` channels, e.g. by a trigger calling pg_notify or through
+    `notify_cache_invalidation`, as long as `run_cache_invalidation` runs in the process.
+    Calls inside a transaction which may have written, and calls with unhashable arguments are not cached.
+    The same result object is returned to all callers and must not be modified.
+
+        @cached(ttl=60, invalidate_on="config")
+        @with_db_transaction(read_only=True)
+        async def get_config(self, *, conn: Connection) -> Config:
+            ...
+    """
+    channels = [invalidate_on] if isinstance(invalidate_on, str) else list(invalidate_on)
+
+    def decorator(func: Callable[Concatenate[S, P], Awaitable[R]]) -> Callable[Concatenate[S, P], Awaitable[R]]:
+        cache = ResultCache(name=func.__qualname__, max_size=max_size, ttl=ttl)
+        for channel in channels:
+            _caches_by_channel[channel].append(cache)
+
+        @wraps(func)
+        async def wrapper(self: S, *args: P.args, **kwargs: P.kwargs) -> R:
+            scope = current_scope()
+            if scope is not None and not scope.read_only:
+                return await func(self, *args, **kwargs)
+
+            try:
+                key = (self, args, frozenset((k, v) for k, v in kwargs.items() if k != "conn"))
+                found, value = cache.get(key)
+            except TypeError:
+                return await func(self, *args, **kwargs)
+            if found:
+                return value
+
+            # an invalidation arriving while func runs might concern the data it has already read
+            generation = cache.generation
+            result = await func(self, *args, **kwargs)
+            cache.put(key, result, generation=generation)
+            return result
+
+        wrapper.cache = cache  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
+
+
+def invalidate_channel(channel: str):
+    """drop all entries of the caches invalidated by the given channel in this process"""
+    for cache in _caches_by_channel.get(channel, []):
+        cache.clear()
+
+
+async def notify_cache_invalidation(conn: Connection, channel: str):
+    """invalidate the caches of the given channel in all processes, once the current transaction commits"""
+    await conn.execute("select pg_notify($1, '')", channel)
+
+
+async def run_cache_invalidation(pool: Pool, channels: Sequence[str] | None = None):
+    """
+    Listen to the channels of all cached methods, or only to `channels`, and invalidate their caches on every
+    notification until cancelled. The caches are also invalidated whenever the listening connection is (re)established
+    as notifications might have been missed in between.
+    The notifications are received over the connection of `Pool.notifications` shared with all DatabaseHooks.
+    """
+    if channels is None:
+        channels = list(_caches_by_channel.keys())
+
+    def invalidate(connection: Connection, pid: int, channel: str, payload: str):
+        del connection, pid, payload
+        logger.debug(f"Invalidating the caches of channel {channel}")
+        invalidate_channel(channel)
+
+    async with contextlib.AsyncExitStack() as stack:
+        for channel in channels:
+            on_connect = functools.partial(invalidate_channel, channel)
+            await stack.enter_async_context(pool.notifications.subscription(channel, invalidate, on_connect=on_connect))
+            on_connect()
+        await asyncio.Event().wait()
@@ -2,9 +2,22 @@ from sftkit.database._attach import psql_attach
 from sftkit.database._config import DatabaseConfig
 from sftkit.database._connection import Connection
 from sftkit.database._database import Database
-from sftkit.database._hook import DatabaseHook
+from sftkit.database._hook import DatabaseHook, HookStats
+from sftkit.database._instrumentation import (
+    CallSiteStats,
+    PoolMetrics,
+    PoolStats,
+    QueryPlan,
+    QueryPlans,
+    QueryStatistics,
+    QueryStats,
+)
+from sftkit.database._loader import BatchLoader
 from sftkit.database._migrations import SchemaMigration, create_migration
+from sftkit.database._notifications import NotificationDispatcher
 from sftkit.database._pool import Pool, create_db_pool
+from sftkit.database._replicas import ReplicaSet
+from sftkit.database._scope import ConnectionScope, connection_scope, current_connection, current_scope
 
 __all__ = [
     "Database",
@@ -16,4 +29,19 @@ __all__ = [
     "create_migration",
     "Pool",
     "DatabaseHook",
+    "HookStats",
+    "NotificationDispatcher",
+    "BatchLoader",
+    "QueryStatistics",
+    "QueryStats",
+    "QueryPlan",
+    "QueryPlans",
+    "ReplicaSet",
+    "PoolMetrics",
+    "PoolStats",
+    "CallSiteStats",
+    "ConnectionScope",
+    "connection_scope",
+    "current_connection",
+    "current_scope",
 ]
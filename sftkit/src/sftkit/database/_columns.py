@@ -0,0 +1,70 @@
+"""
+column oriented result sets
+"""
+
+import array
+from typing import Any, Sequence
+
+import asyncpg
+
+# postgres type name -> array.array typecode
+_TYPECODES = {
+    "bool": "B",
+    "int2": "h",
+    "int4": "i",
+    "int8": "q",
+    "oid": "I",
+    "float4": "f",
+    "float8": "d",
+}
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+
+def numpy_available() -> bool:
+    return numpy is not None
+
+
+class ColumnBuilder:
+    """
+    Accumulates the values of one result column.
+
+    Values of fixed size numeric types are stored in a typed array.array, all others in a list.
+    If a NULL is encountered in a numeric column the column falls back to a list.
+    """
+
+    def __init__(self, name: str, type_name: str, type_schema: str):
+        self.name = name
+        self.type_name = type_name
+        typecode = _TYPECODES.get(type_name) if type_schema == "pg_catalog" else None
+        self.values: array.array | list = array.array(typecode) if typecode is not None else []
+
+    def extend(self, values: Sequence[Any]):
+        if isinstance(self.values, array.array):
+            length = len(self.values)
+            try:
+                self.values.extend(values)
+                return
+            except TypeError:
+                # the column contains NULLs, drop the partially extended values and switch to a list
+                del self.values[length:]
+                self.values = self.values.tolist()
+        self.values.extend(values)
+
+    def result(self, use_numpy: bool) -> Any:
+        if not use_numpy or not isinstance(self.values, array.array):
+            return self.values
+        assert numpy is not None
+        data = numpy.frombuffer(self.values, dtype=self.values.typecode)
+        if self.type_name == "bool":
+            return data.view(numpy.bool_)
+        return data
+
+
+def column_builders(attributes: Sequence[asyncpg.Attribute]) -> list[ColumnBuilder]:
+    return [
+        ColumnBuilder(name=attr.name, type_name=attr.type.name, type_schema=attr.type.schema) for attr in attributes
+    ]
@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 
+from sftkit.database._json import JsonCodecName
+
 
 class DatabaseConfig(BaseModel):
     user: str | None = None
@@ -9,3 +11,66 @@ class DatabaseConfig(BaseModel):
     dbname: str
     require_ssl: bool = False
     sslrootcert: str | None = None
+    # the database is reached through a connection pooler in transaction mode (e.g. PgBouncer with
+    # pool_mode = transaction) which hands every transaction to a possibly different server connection. asyncpg's
+    # statement cache is disabled, named statements asyncpg needs for cursors and COPY are closed within the
+    # transaction that prepared them and no server settings are sent on connect (set jit = off on the database instead)
+    transaction_pooling: bool = False
+    # with transaction_pooling: the pooler keeps track of named prepared statements itself (PgBouncer >= 1.21 with
+    # max_prepared_statements > 0), asyncpg's statement cache stays enabled
+    pooler_prepared_statements: bool = False
+    # with transaction_pooling: the database server bypassing the pooler, used for LISTEN and migrations which need
+    # a session of their own, defaults to host and port
+    direct_host: str | None = None
+    direct_port: int | None = None
+    # read only replicas given as "host" or "host:port", read only service transactions are routed to them
+    replica_hosts: list[str] = []
+    # replicas lagging behind the primary by more than this number of seconds are not used
+    max_replica_lag: float | None = 10.0
+    # interval in seconds in which the availability and lag of the replicas is checked
+    replica_lag_check_interval: float = 1.0
+    # number of connections a pool keeps open even when idle, defaults to the full pool size
+    min_connections: int | None = None
+    # close connections which have been idle for this number of seconds as long as more than min_connections are open,
+    # 0 disables closing idle connections
+    max_idle_time: float = 300.0
+    # close connections which have been open for longer than this number of seconds when they are released
+    max_connection_lifetime: float | None = None
+    # implementation used to (de)serialize json and jsonb values, "auto" picks orjson or msgspec if installed.
+    # orjson and msgspec write NaN and Infinity as null, orjson does not support integers beyond 64 bits
+    json_codec: JsonCodecName = "json"
+    # transfer json and jsonb values in the binary wire format instead of text
+    json_binary_format: bool = True
+    # introspect array and application defined types once per pool instead of on their first use on every connection
+    warm_type_cache: bool = True
+    # collect call counts, latency histograms and returned rows per statement, see Pool.query_statistics
+    collect_query_statistics: bool = False
+    # collect acquire wait times and connection hold times per call site, see Pool.stats
+    collect_pool_metrics: bool = False
+    # log statements taking longer than this number of seconds
+    slow_query_threshold: float | None = None
+    # re-run statements taking longer than this number of seconds with EXPLAIN (ANALYZE, BUFFERS) inside a rolled back
+    # savepoint and keep their plans in Pool.query_plans
+    explain_threshold: float | None = None
+    # fraction of statements whose plans are captured independent of their duration
+    explain_sample_rate: float = 0.0
+    # number of most recent plans kept in Pool.query_plans
+    explain_max_plans: int = 100
+    # log a warning with the call stack whenever a connection is acquired by a task which already holds one through a
+    # service method, nested acquires need twice the connections and can exhaust the pool under load
+    debug_nested_acquire: bool = False
+
+    def direct(self) -> "DatabaseConfig":
+        """
+        config connecting to the primary database server itself, bypassing a transaction pooler, without replicas
+        """
+        if not self.transaction_pooling:
+            return self.model_copy(update={"replica_hosts": []})
+        return self.model_copy(
+            update={
+                "host": self.direct_host or self.host,
+                "port": self.direct_port or self.port,
+                "transaction_pooling": False,
+                "replica_hosts": [],
+            }
+        )
@@ -1,35 +1,424 @@
-import json
-from typing import Type, TypeVar
+import contextlib
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, AsyncIterator, Iterable, Sequence, Type, TypeVar
 
 import asyncpg
 from pydantic import BaseModel
 
+from sftkit.database._columns import column_builders, numpy_available
+from sftkit.database._copy import (
+    OnConflict,
+    build_upsert_query,
+    model_columns,
+    model_records,
+    peek_models,
+    qualified_name,
+    quote_ident,
+)
+from sftkit.database._instrumentation import QueryPlans, QueryStatistics
+from sftkit.database._json import JsonCodec
+from sftkit.database._loader import BatchLoader
+from sftkit.database._mapper import ModelRecord, RowMapper, mapper_for_record
+from sftkit.database._type_cache import TypeCache
 from sftkit.error import NotFound
 
+logger = logging.getLogger(__name__)
+
 T = TypeVar("T", bound=BaseModel)
 
 
 class Connection(asyncpg.Connection):
-    async def fetch_one(self, model: Type[T], query: str, *args) -> T:
-        result: asyncpg.Record | None = await self.fetchrow(query, *args)
+    """
+    asyncpg connection with helpers to directly fetch pydantic models.
+
+    All fetch helpers accept a keyword only `trusted` flag, if set the returned rows are not validated but directly
+    converted into model instances. Only use this for queries whose result types are guaranteed to match the model.
+
+    If `query_statistics` is set, execution time and returned rows of every statement are recorded.
+    If `query_plans` is set, the plans of slow statements are captured.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_statistics: QueryStatistics | None = None
+        self.query_plans: QueryPlans | None = None
+        self._instrumented = False
+        self.created_at = time.monotonic()
+        # set by the pool while the connection is acquired with pool metrics enabled
+        self.acquired_at = 0.0
+        self.acquired_by: str | None = None
+        # named statements have to be closed in the transaction which prepared them, see transaction_pooling
+        self.scoped_statements = False
+
+    def set_instrumentation(self, query_statistics: QueryStatistics | None, query_plans: QueryPlans | None):
+        self.query_statistics = query_statistics
+        self.query_plans = query_plans
+        self._instrumented = query_statistics is not None or query_plans is not None
+
+    @contextlib.contextmanager
+    def _uninstrumented(self):
+        instrumented = self._instrumented
+        self._instrumented = False
+        try:
+            yield
+        finally:
+            self._instrumented = instrumented
+
+    async def reset(self, *, timeout=None):
+        # the statements asyncpg issues itself when a connection is released are not instrumented
+        with self._uninstrumented():
+            await super().reset(timeout=timeout)
+
+    async def _reset(self):
+        with self._uninstrumented():
+            await super()._reset()
+
+    async def _timed(self, query: str, args: Sequence[Any], coro, count_rows, explain: bool = True):
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except BaseException:
+            if self.query_statistics is not None:
+                self.query_statistics.record(query, args, time.perf_counter() - start, rows=0, failed=True)
+            raise
+        elapsed = time.perf_counter() - start
+        if self.query_statistics is not None:
+            self.query_statistics.record(query, args, elapsed, rows=count_rows(result))
+        if explain and self.query_plans is not None and self.query_plans.should_capture(query, elapsed):
+            await self._capture_plan(query, args, elapsed)
+        return result
+
+    async def _capture_plan(self, query: str, args: Sequence[Any], elapsed: float):
+        assert self.query_plans is not None
+        # the savepoint and the explain itself do not show up in the statistics
+        with self._uninstrumented():
+            transaction = self.transaction()
+            try:
+                await transaction.start()
+            except asyncpg.InterfaceError:
+                # manually started transactions cannot be nested
+                return
+            try:
+                plan = await super().fetchval(f"explain (analyze, buffers, format json) {query}", *args)
+            except asyncpg.PostgresError as e:
+                logger.debug(f"Failed to capture query plan: {e}")
+                return
+            finally:
+                await transaction.rollback()
+        self.query_plans.add(query, args, elapsed, plan)
+
+    async def execute(self, query: str, *args, timeout: float | None = None) -> str:
+        if not self._instrumented:
+            return await super().execute(query, *args, timeout=timeout)
+        return await self._timed(query, args, super().execute(query, *args, timeout=timeout), _status_rows)
+
+    async def executemany(self, command: str, args, *, timeout: float | None = None):
+        if not self._instrumented:
+            return await super().executemany(command, args, timeout=timeout)
+        return await self._timed(
+            command, (), super().executemany(command, args, timeout=timeout), _no_rows, explain=False
+        )
+
+    async def fetch(self, query, *args, timeout=None, record_class=None) -> list:
+        if not self._instrumented:
+            return await super().fetch(query, *args, timeout=timeout, record_class=record_class)
+        return await self._timed(
+            query, args, super().fetch(query, *args, timeout=timeout, record_class=record_class), len
+        )
+
+    async def fetchmany(self, query, args, *, timeout: float | None = None, record_class=None):
+        if not self._instrumented:
+            return await super().fetchmany(query, args, timeout=timeout, record_class=record_class)
+        return await self._timed(
+            query,
+            (),
+            super().fetchmany(query, args, timeout=timeout, record_class=record_class),
+            len,
+            explain=False,
+        )
+
+    async def fetchrow(self, query, *args, timeout=None, record_class=None):
+        if not self._instrumented:
+            return await super().fetchrow(query, *args, timeout=timeout, record_class=record_class)
+        return await self._timed(
+            query, args, super().fetchrow(query, *args, timeout=timeout, record_class=record_class), _single_row
+        )
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        if not self._instrumented:
+            return await super().fetchval(query, *args, column=column, timeout=timeout)
+        return await self._timed(
+            query, args, super().fetchval(query, *args, column=column, timeout=timeout), _single_row
+        )
+
+    async def fetch_one(self, model: Type[T], query: str, *args, trusted: bool = False) -> T:
+        result: asyncpg.Record | None = await self.fetchrow(query, *args, record_class=ModelRecord)
         if result is None:
             raise NotFound(element_type=model.__name__)
 
-        return model.model_validate(dict(result))
+        return mapper_for_record(model, result, trusted).map_one(result)
 
-    async def fetch_maybe_one(self, model: Type[T], query: str, *args) -> T | None:
-        result: asyncpg.Record | None = await self.fetchrow(query, *args)
+    async def fetch_maybe_one(self, model: Type[T], query: str, *args, trusted: bool = False) -> T | None:
+        result: asyncpg.Record | None = await self.fetchrow(query, *args, record_class=ModelRecord)
         if result is None:
             return None
 
-        return model.model_validate(dict(result))
+        return mapper_for_record(model, result, trusted).map_one(result)
+
+    async def fetch_many(self, model: Type[T], query: str, *args, trusted: bool = False) -> list[T]:
+        results: list[asyncpg.Record] = await self.fetch(query, *args, record_class=ModelRecord)
+        if len(results) == 0:
+            return []
+        return mapper_for_record(model, results[0], trusted).map_many(results)
+
+    @contextlib.asynccontextmanager
+    async def fetch_iter(
+        self, model: Type[T], query: str, *args, prefetch: int = 1000, trusted: bool = False
+    ) -> AsyncIterator[AsyncIterator[T]]:
+        """
+        Iterate over the result of a query using a server side cursor.
+
+            async with conn.fetch_iter(User, 'select * from "user"') as users:
+                async for user in users:
+                    ...
+
+        At most `prefetch` rows are transferred and validated at once, memory usage therefore stays constant
+        independent of the total number of rows returned by the query.
+        Cursors can only be used inside a transaction, if the connection is not in a transaction already one
+        is opened until the context is left, also if the iteration is stopped early.
+        """
+        if prefetch <= 0:
+            raise ValueError("prefetch must be greater than zero")
+
+        async with self._cursor_transaction(), self._scoped_statements():
+            rows = _iter_cursor(
+                await self.cursor(query, *args, record_class=ModelRecord), model, prefetch=prefetch, trusted=trusted
+            )
+            try:
+                yield rows
+            finally:
+                # drops the cursor such that its statement can be closed
+                await rows.aclose()
+
+    def batch_loader(
+        self,
+        model: Type[T],
+        query: str,
+        key_column: str = "id",
+        max_batch_size: int | None = None,
+        trusted: bool = False,
+    ) -> BatchLoader[Any, T]:
+        """
+        Create a loader which batches concurrent lookups by key into one query, see BatchLoader.
+
+        `query` receives the list of keys as its only argument, e.g. `select * from "user" where id = any($1)`.
+        """
+        return BatchLoader(
+            self, model=model, query=query, key_column=key_column, max_batch_size=max_batch_size, trusted=trusted
+        )
+
+    async def fetch_columns(
+        self, query: str, *args, prefetch: int = 10000, use_numpy: bool | None = None
+    ) -> dict[str, Any]:
+        """
+        Fetch the result of a query in column oriented form, returns a dict mapping column names to column values.
+
+        Columns of fixed size numeric types (bool, int2, int4, int8, oid, float4, float8) are returned as typed
+        array.array, or as numpy arrays if numpy is installed (can be forced on or off via `use_numpy`).
+        Numeric columns containing NULLs as well as all other columns are returned as lists.
+        No models are created, rows are read through a cursor in chunks of `prefetch` records which are
+        discarded once their values have been appended to the columns.
+        """
+        if use_numpy is None:
+            use_numpy = numpy_available()
+        elif use_numpy and not numpy_available():
+            raise ValueError("numpy is not installed")
+
+        async with self._cursor_transaction(), self._scoped_statements():
+            stmt = await self.prepare(query)
+            columns = column_builders(stmt.get_attributes())
+            cursor = await stmt.cursor(*args)
+            while True:
+                records: list[asyncpg.Record] = await cursor.fetch(prefetch)
+                if len(records) == 0:
+                    break
+                for column, values in zip(columns, zip(*records)):
+                    column.extend(values)
+                del records
+            del stmt, cursor
+
+        return {column.name: column.result(use_numpy) for column in columns}
+
+    async def insert_many(
+        self,
+        table: str,
+        models: Iterable[BaseModel] | AsyncIterable[BaseModel],
+        *,
+        schema_name: str | None = None,
+        columns: Sequence[str] | None = None,
+        on_conflict: OnConflict = "error",
+        conflict_columns: Sequence[str] | None = None,
+        update_columns: Sequence[str] | None = None,
+    ) -> int:
+        """
+        Insert pydantic models into a table using COPY, returns the number of inserted or updated rows.
+
+        The inserted columns default to the fields of the first model in declaration order (using aliases if set),
+        `columns` restricts them to a subset.
+        With on_conflict="error" the models are copied directly into the target table. With "ignore" or "update"
+        they are copied into a temporary staging table first and then merged into the target table via
+        `insert ... on conflict do nothing` or `insert ... on conflict (conflict_columns) do update`, by default
+        updating all inserted columns that are not part of the conflict target.
+        """
+        first, all_models = await peek_models(models)
+        if first is None:
+            return 0
+
+        if columns is None:
+            columns = model_columns(type(first))
+
+        records = model_records(all_models, columns)
+        if on_conflict == "error":
+            async with self._scoped_statements():
+                status = await self.copy_records_to_table(
+                    table, records=records, columns=columns, schema_name=schema_name
+                )
+            return int(status.split()[-1])
+
+        staging_table = "_sftkit_insert_staging"
+        merge_query = build_upsert_query(
+            table=qualified_name(table, schema_name),
+            staging_table=staging_table,
+            columns=columns,
+            on_conflict=on_conflict,
+            conflict_columns=conflict_columns,
+            update_columns=update_columns,
+        )
+        async with self.transaction(), self._scoped_statements():
+            await self.execute(
+                f"create temporary table {staging_table} on commit drop as "
+                f"select {', '.join(quote_ident(c) for c in columns)} from {qualified_name(table, schema_name)} "
+                "with no data"
+            )
+            await self.copy_records_to_table(staging_table, records=records, columns=columns)
+            status = await self.execute(merge_query)
+            await self.execute(f"drop table {staging_table}")
+        return int(status.split()[-1])
+
+    async def upsert_many(
+        self,
+        table: str,
+        models: Iterable[BaseModel] | AsyncIterable[BaseModel],
+        conflict_columns: Sequence[str],
+        *,
+        schema_name: str | None = None,
+        columns: Sequence[str] | None = None,
+        update_columns: Sequence[str] | None = None,
+    ) -> int:
+        """insert or update the given models, shorthand for `insert_many(..., on_conflict="update")`"""
+        return await self.insert_many(
+            table,
+            models,
+            schema_name=schema_name,
+            columns=columns,
+            on_conflict="update",
+            conflict_columns=conflict_columns,
+            update_columns=update_columns,
+        )
+
+    @contextlib.asynccontextmanager
+    async def _scoped_statements(self):
+        """
+        behind a transaction pooler the named statements asyncpg prepares for cursors and COPY are closed before the
+        transaction ends, otherwise they would linger on a server connection the pooler hands to other clients
+        """
+        if not self.scoped_statements:
+            yield
+            return
+
+        async with self._cursor_transaction():
+            try:
+                yield
+            finally:
+                await self._cleanup_stmts()  # pylint: disable=protected-access
+
+    @contextlib.asynccontextmanager
+    async def _cursor_transaction(self):
+        if self.is_in_transaction():
+            yield
+            return
+
+        async with self.transaction():
+            yield
+
+
+async def _iter_cursor(cursor, model: Type[T], *, prefetch: int, trusted: bool) -> AsyncGenerator[T, None]:
+    mapper: RowMapper[T] | None = None
+    while True:
+        records: list[asyncpg.Record] = await cursor.fetch(prefetch)
+        if len(records) == 0:
+            return
+        if mapper is None:
+            mapper = mapper_for_record(model, records[0], trusted)
+        chunk = mapper.map_many(records)
+        del records
+        for item in chunk:
+            yield item
+
+
+def _status_rows(status: str) -> int:
+    # command status tags end with the number of affected rows, e.g. "UPDATE 5", but not all of them, e.g. "BEGIN"
+    count = status.rsplit(" ", 1)[-1]
+    return int(count) if count.isdigit() else 0
+
+
+def _single_row(result) -> int:
+    return 0 if result is None else 1
+
+
+def _no_rows(result) -> int:
+    del result
+    return 0
+
 
-    async def fetch_many(self, model: Type[T], query: str, *args) -> list[T]:
-        # TODO: also allow async cursor
-        results: list[asyncpg.Record] = await self.fetch(query, *args)
-        return [model.model_validate(dict(r)) for r in results]
+async def init_connection(
+    conn: Connection,
+    json_codec: JsonCodec,
+    *,
+    json_binary_format: bool = True,
+    query_statistics: QueryStatistics | None = None,
+    query_plans: QueryPlans | None = None,
+    type_cache: TypeCache | None = None,
+    scoped_statements: bool = False,
+):
+    # codecs are client side state of the connection and therefore not affected by transaction pooling
+    conn.scoped_statements = scoped_statements
+    if json_binary_format:
+        await conn.set_type_codec(
+            "json",
+            encoder=json_codec.encode_json_binary,
+            decoder=json_codec.decode_json_binary,
+            schema="pg_catalog",
+            format="binary",
+        )
+        await conn.set_type_codec(
+            "jsonb",
+            encoder=json_codec.encode_jsonb_binary,
+            decoder=json_codec.decode_jsonb_binary,
+            schema="pg_catalog",
+            format="binary",
+        )
+    else:
+        await conn.set_type_codec(
+            "json", encoder=json_codec.encode_text, decoder=json_codec.decode_text, schema="pg_catalog"
+        )
+        await conn.set_type_codec(
+            "jsonb", encoder=json_codec.encode_text, decoder=json_codec.decode_text, schema="pg_catalog"
+        )
 
+    # registering custom codecs drops previously introspected types, hence the cached types are registered afterwards
+    if type_cache is not None:
+        await type_cache.register(conn)
 
-async def init_connection(conn: Connection):
-    await conn.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
-    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    conn.set_instrumentation(query_statistics=query_statistics, query_plans=query_plans)
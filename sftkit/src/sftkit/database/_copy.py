@@ -0,0 +1,93 @@
+"""
+helpers to stream pydantic models into tables via COPY
+"""
+
+import functools
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Literal, Sequence, Type
+
+from pydantic import BaseModel
+
+OnConflict = Literal["error", "ignore", "update"]
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def qualified_name(table: str, schema_name: str | None) -> str:
+    if schema_name is None:
+        return quote_ident(table)
+    return f"{quote_ident(schema_name)}.{quote_ident(table)}"
+
+
+@functools.lru_cache(maxsize=256)
+def model_columns(model: Type[BaseModel]) -> tuple[str, ...]:
+    """column names of a model in field declaration order, aliases are used as column names if present"""
+    return tuple(field.alias or name for name, field in model.model_fields.items())
+
+
+def _to_record(model: BaseModel, columns: Sequence[str]) -> tuple:
+    values = model.model_dump(by_alias=True)
+    return tuple(values[c] for c in columns)
+
+
+async def peek_models(
+    models: Iterable[BaseModel] | AsyncIterable[BaseModel],
+) -> tuple[BaseModel | None, AsyncIterator[BaseModel]]:
+    """return the first model and an async iterator over all models, including the first one"""
+    if isinstance(models, AsyncIterable):
+        iterator = aiter(models)
+        first = await anext(iterator, None)
+    else:
+        sync_iterator = iter(models)
+        first = next(sync_iterator, None)
+
+        async def _wrap():
+            for m in sync_iterator:
+                yield m
+
+        iterator = _wrap()
+
+    async def _chain():
+        if first is None:
+            return
+        yield first
+        async for m in iterator:
+            yield m
+
+    return first, _chain()
+
+
+async def model_records(models: AsyncIterable[BaseModel], columns: Sequence[str]) -> AsyncIterator[tuple[Any, ...]]:
+    async for model in models:
+        yield _to_record(model, columns)
+
+
+def build_upsert_query(
+    table: str,
+    staging_table: str,
+    columns: Sequence[str],
+    *,
+    on_conflict: Literal["ignore", "update"],
+    conflict_columns: Sequence[str] | None,
+    update_columns: Sequence[str] | None,
+) -> str:
+    column_list = ", ".join(quote_ident(c) for c in columns)
+    query = f"insert into {table} ({column_list}) select {column_list} from {staging_table}"
+    conflict_target = ""
+    if conflict_columns:
+        conflict_target = f" ({', '.join(quote_ident(c) for c in conflict_columns)})"
+
+    if on_conflict == "ignore":
+        return f"{query} on conflict{conflict_target} do nothing"
+
+    if not conflict_columns:
+        raise ValueError("conflict_columns are required when updating rows on conflict")
+
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in conflict_columns]
+    if len(update_columns) == 0:
+        return f"{query} on conflict{conflict_target} do nothing"
+
+    assignments = ", ".join(f"{quote_ident(c)} = excluded.{quote_ident(c)}" for c in update_columns)
+    return f"{query} on conflict{conflict_target} do update set {assignments}"
@@ -14,8 +14,8 @@ class Database:
 
         self._pool: Pool | None = None
 
-    async def create_pool(self, n_connections=10) -> Pool:
-        self._pool = await create_db_pool(self.config, n_connections=n_connections)
+    async def create_pool(self, n_connections=10, min_connections: int | None = None) -> Pool:
+        self._pool = await create_db_pool(self.config, n_connections=n_connections, min_connections=min_connections)
         return self._pool
 
     async def apply_migrations(
@@ -24,7 +24,7 @@ class Database:
         function_blacklist: list[str] | None = None,
         function_blacklist_prefix: str | None = None,
     ) -> None:
-        pool = await self.create_pool(n_connections=1)
+        pool = await create_db_pool(self.config.direct(), n_connections=1)
         try:
             await apply_migrations(
                 db_pool=pool,
@@ -36,6 +36,12 @@ class Database:
             )
         finally:
             await pool.close()
+        await self._schema_changed()
+
+    async def _schema_changed(self):
+        """connections of the application pool have to pick up changed types"""
+        if self._pool is not None:
+            await self._pool.expire_connections()
 
     async def attach(self):
         return await psql_attach(self.config)
@@ -45,7 +51,7 @@ class Database:
         function_blacklist: list[str] | None = None,
         function_blacklist_prefix: str | None = None,
     ):
-        pool = await self.create_pool(n_connections=1)
+        pool = await create_db_pool(self.config.direct(), n_connections=1)
 
         try:
             async with pool.acquire() as conn:
@@ -58,6 +64,7 @@ class Database:
                     )
         finally:
             await pool.close()
+        await self._schema_changed()
 
     def list_migrations(self) -> list[SchemaMigration]:
         return SchemaMigration.migrations_from_dir(self.migrations_dir)
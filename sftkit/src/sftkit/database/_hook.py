@@ -3,67 +3,143 @@ database notification subscriber
 """
 
 import asyncio
-import contextlib
+import collections
 import inspect
 import logging
-from typing import Callable, Coroutine, Optional
+from typing import Callable, Coroutine, Hashable, Literal, Optional, Union
 
 import asyncpg.exceptions
+from pydantic import BaseModel
 
 from ._connection import Connection
+from ._notifications import NotificationDispatcher
+from ._pool import Pool
+
+# what to do with a notification arriving while the queue is full:
+# "drop_oldest" drops the oldest queued payload, "resync" drops all queued payloads,
+# "spill" keeps the payloads in an unbounded overflow buffer
+OverflowPolicy = Literal["drop_oldest", "resync", "spill"]
+
+
+class HookStats(BaseModel):
+    channel: str
+    queued: int
+    # payloads currently held in the overflow buffer and their maximum number so far
+    spilled: int
+    max_spilled: int
+    # payloads dropped due to the overflow policy
+    dropped: int
+    # number of times notifications might have been missed, by dropping them or by losing the connection
+    resyncs: int
+
+
+class _Resync:
+    """queued to wake up the hook when a resync is due"""
 
 
 class DatabaseHook:
     """
     Implements a database hook to subscribe to one specific pg_notify notification channel.
+
+    The notifications of all hooks on a sftkit Pool are received over the single connection of `Pool.notifications`.
+
+    Bursts of notifications can be coalesced: with `debounce` the hook waits that many seconds after a notification
+    and collapses duplicate payloads received meanwhile. With `batch_size` the handler receives lists of up to
+    `batch_size` payloads received within `batch_timeout` seconds after the first one instead of single payloads.
+
+    At most `queue_size` payloads wait for the handler, further ones are dealt with according to `overflow`.
+    Whenever notifications have been dropped or the listening connection has been reestablished the handler is
+    called with None again like for `initial_run`, such that it can catch up on what it missed. Without
+    `initial_run` the handler is not expected to accept None and the loss is only logged.
+
+    `run(num_parallel)` handles up to num_parallel payloads at once in no particular order. With `partition_key`
+    payloads mapping to the same key are handled strictly one after the other in the order of their arrival, while
+    up to num_parallel keys are handled at once.
     """
 
     def __init__(
         self,
         pool: asyncpg.Pool,
         channel: str,
-        event_handler: Callable[[Optional[str]], Coroutine],
+        event_handler: Union[Callable[[Optional[str]], Coroutine], Callable[[Optional[list[str]]], Coroutine]],
         initial_run: bool = False,
         hook_timeout: int = 5,
+        *,
+        dispatcher: NotificationDispatcher | None = None,
+        debounce: float | None = None,
+        batch_size: int | None = None,
+        batch_timeout: float = 0.1,
+        queue_size: int = 2048,
+        overflow: OverflowPolicy = "drop_oldest",
+        partition_key: Callable[[str], Hashable] | None = None,
     ):
         """
         connection: open database connection
         channel: subscription channel of the database
         event_handler: async function which receives the payload of the database notification as argument
         initial_run: true if we shall call the handler once after startup with None as argument.
+        dispatcher: receives the notifications, defaults to the one of the pool
+        debounce: seconds to wait for duplicates of a payload, which are dropped
+        batch_size: if set the handler receives lists of at most batch_size payloads
+        batch_timeout: seconds to wait for further payloads of a batch
+        queue_size: number of payloads which may wait for the handler
+        overflow: what to do with payloads arriving while the queue is full
+        partition_key: maps a payload to the key of the payloads which must be handled in order
         """
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least one")
+        if batch_size is not None and partition_key is not None:
+            raise ValueError("batches cannot be partitioned")
         self.db_pool = pool
+        if dispatcher is None:
+            dispatcher = pool.notifications if isinstance(pool, Pool) else NotificationDispatcher(pool.acquire)
+        self.dispatcher = dispatcher
         self.channel = channel
         self.event_handler = event_handler
         assert inspect.iscoroutinefunction(event_handler)
         self.initial_run = initial_run
         self.timelimit = hook_timeout
+        self.debounce = debounce
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.overflow = overflow
+        self.partition_key = partition_key
 
-        self.events: asyncio.Queue[str | StopIteration] = asyncio.Queue(maxsize=2048)
+        self.events: asyncio.Queue[str | StopIteration | _Resync] = asyncio.Queue(maxsize=queue_size)
         self.logger = logging.getLogger(__name__)
 
         self.current_tasks: set[asyncio.Task] = set()
+        # payloads waiting in the queue, duplicates of which are not queued again when debouncing
+        self._queued: set[str] = set()
+        # payloads which did not fit into the queue with the "spill" policy, in order of arrival
+        self._spilled: collections.deque[str] = collections.deque()
+        self._max_spilled = 0
+        self._dropped = 0
+        self._resyncs = 0
+        self._resync_pending = False
+        # whether the initial run for the current subscription has been done, later connects require a resync
+        self._listening = False
+        # payloads waiting for the payloads of the same key to be handled, by partition key
+        self._partitions: dict[Hashable, collections.deque[str]] = {}
+        self._partition_progress = asyncio.Event()
 
-    @contextlib.asynccontextmanager
-    async def acquire_conn(self):
-        async with self.db_pool.acquire() as conn:
-            await self._register(conn=conn)
-            try:
-                yield conn
-            finally:
-                await self._deregister(conn=conn)
-
-    async def _register(self, conn: Connection):
-        await conn.add_listener(self.channel, self.notification_callback)
-
-    async def _deregister(self, conn: Connection):
-        await conn.remove_listener(self.channel, self.notification_callback)
+    def stats(self) -> HookStats:
+        return HookStats(
+            channel=self.channel,
+            queued=self.events.qsize(),
+            spilled=len(self._spilled),
+            max_spilled=self._max_spilled,
+            dropped=self._dropped,
+            resyncs=self._resyncs,
+        )
 
     def stop(self):
         # proper way of clearing asyncio queue
         for _ in range(self.events.qsize()):
             self.events.get_nowait()
             self.events.task_done()
+        self._queued.clear()
+        self._spilled.clear()
         self.events.put_nowait(StopIteration())
 
     async def stop_async(self):
@@ -71,31 +147,25 @@ class DatabaseHook:
         for _ in range(self.events.qsize()):
             self.events.get_nowait()
             self.events.task_done()
+        self._queued.clear()
+        self._spilled.clear()
         await self.events.put(StopIteration())
 
     async def run(self, num_parallel=1):
         async with asyncio.TaskGroup() as tg:
             while True:
                 try:
-                    async with self.acquire_conn():
+                    async with self.dispatcher.subscription(
+                        self.channel, self.notification_callback, on_connect=self._on_connect
+                    ):
+                        self._listening = True
+                        self._resync_pending = False
                         if self.initial_run:
                             # run the handler once to process pending data
                             await self.event_handler(None)
 
-                        # handle events
-                        while True:
-                            event: str | StopIteration = await self.events.get()
-                            if isinstance(event, StopIteration):
-                                return
-
-                            task: asyncio.Task = tg.create_task(self.event_handler(event))
-                            self.current_tasks.add(task)
-
-                            if len(self.current_tasks) >= num_parallel:
-                                done, _ = await asyncio.wait(self.current_tasks, return_when=asyncio.FIRST_COMPLETED)
-                                self.current_tasks.difference_update(done)
-
-                            self.events.task_done()
+                        await self._handle_events(tg, num_parallel)
+                        return
                 except asyncio.exceptions.TimeoutError:
                     self.logger.error("Timout occurred during DBHook.run")
                 except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
@@ -106,6 +176,169 @@ class DatabaseHook:
 
                     self.logger.error(f"Error occurred during DBHook.run: {traceback.format_exc()}")
                     await asyncio.sleep(1)
+                finally:
+                    self._listening = False
+
+    async def _handle_events(self, tg: asyncio.TaskGroup, num_parallel: int):
+        """handle the queued events until the hook is stopped"""
+        while True:
+            event = self._take(await self.events.get())
+            if isinstance(event, StopIteration):
+                return
+            if self._resync_pending:
+                await self._resync()
+            if isinstance(event, _Resync):
+                continue
+
+            payloads = await self._collect(event)
+            if payloads is None:
+                return
+            if self.batch_size is not None:
+                await self._handle(tg, payloads, num_parallel)
+            elif self.partition_key is not None:
+                for payload in payloads:
+                    await self._handle_partitioned(tg, payload, num_parallel)
+            else:
+                for payload in payloads:
+                    await self._handle(tg, payload, num_parallel)
+
+    async def _handle(self, tg: asyncio.TaskGroup, arg: str | list[str], num_parallel: int):
+        task: asyncio.Task = tg.create_task(self.event_handler(arg))  # type: ignore[arg-type]
+        self.current_tasks.add(task)
+
+        if len(self.current_tasks) >= num_parallel:
+            done, _ = await asyncio.wait(self.current_tasks, return_when=asyncio.FIRST_COMPLETED)
+            self.current_tasks.difference_update(done)
+
+    async def _handle_partitioned(self, tg: asyncio.TaskGroup, payload: str, num_parallel: int):
+        assert self.partition_key is not None
+        key = self.partition_key(payload)
+        pending = self._partitions.get(key)
+        if pending is not None:
+            # the payloads of a key are bounded like the queue, the handler of the key picks them up
+            while len(pending) >= self.events.maxsize and key in self._partitions:
+                self._partition_progress.clear()
+                await self._partition_progress.wait()
+            if key in self._partitions:
+                pending.append(payload)
+                return
+
+        if len(self.current_tasks) >= num_parallel:
+            done, _ = await asyncio.wait(self.current_tasks, return_when=asyncio.FIRST_COMPLETED)
+            self.current_tasks.difference_update(done)
+        self._partitions[key] = collections.deque([payload])
+        self.current_tasks.add(tg.create_task(self._run_partition(key)))
+
+    async def _run_partition(self, key: Hashable):
+        """handle the payloads of the key in order until there are no more"""
+        pending = self._partitions[key]
+        try:
+            while pending:
+                await self.event_handler(pending[0])  # type: ignore[arg-type]
+                pending.popleft()
+                self._partition_progress.set()
+        finally:
+            del self._partitions[key]
+            self._partition_progress.set()
+
+    async def _collect(self, first: str) -> list[str] | None:
+        """
+        the payloads to handle together with first, received within the debounce window or the batch timeout.
+        None if the hook has been stopped meanwhile.
+        """
+        if self.debounce is None and self.batch_size is None:
+            return [first]
+        window = self.debounce or 0.0
+        if self.batch_size is not None:
+            window = max(window, self.batch_timeout)
+        limit = self.batch_size or self.events.maxsize
+        deadline = asyncio.get_running_loop().time() + window
+        payloads = [first]
+        seen = {first}
+        while len(payloads) < limit:
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                if remaining <= 0:
+                    event: str | StopIteration | _Resync = self.events.get_nowait()
+                else:
+                    event = await asyncio.wait_for(self.events.get(), timeout=remaining)
+            except (asyncio.QueueEmpty, TimeoutError):
+                break
+            event = self._take(event)
+            if isinstance(event, StopIteration):
+                return None
+            if isinstance(event, _Resync):
+                continue
+            if self.debounce is not None and event in seen:
+                continue
+            seen.add(event)
+            payloads.append(event)
+        return payloads
+
+    def _take(self, event: str | StopIteration | _Resync) -> str | StopIteration | _Resync:
+        """bookkeeping for an event taken from the queue, moves spilled payloads into the freed space"""
+        self.events.task_done()
+        if isinstance(event, str):
+            self._queued.discard(event)
+        while self._spilled and not self.events.full():
+            self.events.put_nowait(self._spilled.popleft())
+        return event
+
+    async def _resync(self):
+        self._resync_pending = False
+        self._resyncs += 1
+        if not self.initial_run:
+            self.logger.warning(f"Notifications of channel {self.channel} might have been missed")
+            return
+        # the handlers of earlier notifications must not overwrite what the resync caught up on
+        if self.current_tasks:
+            await asyncio.wait(self.current_tasks)
+            self.current_tasks.clear()
+        self.logger.info(f"Resyncing channel {self.channel} as notifications might have been missed")
+        await self.event_handler(None)
+
+    def _request_resync(self):
+        self._resync_pending = True
+        if not self.events.full():
+            self.events.put_nowait(_Resync())
+
+    def _on_connect(self):
+        # the initial run takes care of the first connect
+        if self._listening:
+            self._request_resync()
+
+    def _enqueue(self, payload: str):
+        if not self._spilled and not self.events.full():
+            self.events.put_nowait(payload)
+            return
+
+        if self.overflow == "spill":
+            self._spilled.append(payload)
+            self._max_spilled = max(self._max_spilled, len(self._spilled))
+        elif self.overflow == "drop_oldest":
+            oldest = self.events.get_nowait()
+            self.events.task_done()
+            if isinstance(oldest, StopIteration):
+                # the hook is stopping anyways
+                self.events.put_nowait(oldest)
+                return
+            if isinstance(oldest, str):
+                self._queued.discard(oldest)
+                self._dropped += 1
+            self.events.put_nowait(payload)
+            self._resync_pending = True
+        else:
+            for _ in range(self.events.qsize()):
+                dropped = self.events.get_nowait()
+                self.events.task_done()
+                if isinstance(dropped, StopIteration):
+                    self.events.put_nowait(dropped)
+                    return
+                if isinstance(dropped, str):
+                    self._dropped += 1
+            self._dropped += 1
+            self._queued.clear()
+            self._request_resync()
 
     def notification_callback(self, connection: Connection, pid: int, channel: str, payload: str):
         """
@@ -113,4 +346,8 @@ class DatabaseHook:
         """
         del connection, pid
         assert channel == self.channel
-        self.events.put_nowait(payload)
+        if self.debounce is not None:
+            if payload in self._queued:
+                return
+            self._queued.add(payload)
+        self._enqueue(payload)
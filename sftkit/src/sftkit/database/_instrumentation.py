@@ -0,0 +1,340 @@
+"""
+per statement query statistics, slow query logging, query plan capture and connection pool metrics
+"""
+
+import asyncio
+import bisect
+import collections
+import contextlib
+import datetime
+import functools
+import logging
+import os
+import random
+import re
+import sys
+from typing import Any, Sequence
+
+import asyncpg
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# statements beyond this number of distinct normalized queries are accounted under OTHER_STATEMENTS
+MAX_STATEMENTS = 2000
+OTHER_STATEMENTS = "<other>"
+# same for the code locations holding pool connections
+MAX_CALL_SITES = 1000
+OTHER_CALL_SITES = "<other>"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+# statements which can be prefixed with EXPLAIN
+_EXPLAINABLE_RE = re.compile(r"^\s*(select|insert|update|delete|merge|values|table|with)\b", re.IGNORECASE)
+
+# frames from these packages and modules are skipped when determining the calling code location, as are frozen
+# modules whose file names start with "<"
+_INTERNAL_PATHS = (
+    "<",
+    os.path.dirname(os.path.dirname(__file__)),
+    os.path.dirname(asyncpg.__file__),
+    os.path.dirname(asyncio.__file__),
+    contextlib.__file__,
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query such that statements only differing in literal values or formatting are grouped together.
+    """
+    normalized = _WHITESPACE_RE.sub(" ", query).strip()
+    normalized = _STRING_LITERAL_RE.sub("?", normalized)
+    normalized = _NUMBER_LITERAL_RE.sub("?", normalized)
+    return _IN_LIST_RE.sub("(?)", normalized)
+
+
+def _arg_shape(arg: Any) -> str:
+    if isinstance(arg, (str, bytes, list, tuple, dict, set)):
+        return f"{type(arg).__name__}(len={len(arg)})"
+    return type(arg).__name__
+
+
+def _find_caller() -> str:
+    """location of the first stack frame outside of sftkit, asyncpg, asyncio and contextlib"""
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_INTERNAL_PATHS):
+            return f"{filename}:{frame.f_lineno} in {frame.f_code.co_qualname}"
+        frame = frame.f_back  # type: ignore[assignment]
+    return "<unknown>"
+
+
+class QueryStats(BaseModel):
+    query: str
+    calls: int
+    errors: int
+    rows: int
+    total_time: float
+    min_time: float
+    max_time: float
+    mean_time: float
+    # number of calls per latency bucket, the bucket bounds are given by LATENCY_BUCKETS
+    histogram: list[int]
+
+
+class _StatementStats:
+    __slots__ = ("calls", "errors", "rows", "total_time", "min_time", "max_time", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.min_time = float("inf")
+        self.max_time = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def to_model(self, query: str) -> QueryStats:
+        return QueryStats(
+            query=query,
+            calls=self.calls,
+            errors=self.errors,
+            rows=self.rows,
+            total_time=self.total_time,
+            min_time=self.min_time,
+            max_time=self.max_time,
+            mean_time=self.total_time / self.calls,
+            histogram=list(self.histogram),
+        )
+
+
+class QueryStatistics:
+    """
+    Collects call counts, latency histograms and returned rows per normalized statement.
+
+    Statements taking longer than `slow_query_threshold` seconds are logged together with the shapes of their
+    arguments and the calling code location.
+    """
+
+    def __init__(self, enabled: bool = True, slow_query_threshold: float | None = None):
+        self.enabled = enabled
+        self.slow_query_threshold = slow_query_threshold
+        self._stats: dict[str, _StatementStats] = {}
+
+    def record(self, query: str, args: Sequence[Any], elapsed: float, rows: int, failed: bool = False):
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            self._log_slow_query(query, args, elapsed)
+
+        if not self.enabled:
+            return
+
+        normalized = normalize_query(query)
+        stats = self._stats.get(normalized)
+        if stats is None:
+            if len(self._stats) >= MAX_STATEMENTS:
+                normalized = OTHER_STATEMENTS
+            stats = self._stats.setdefault(normalized, _StatementStats())
+
+        stats.calls += 1
+        stats.rows += rows
+        stats.total_time += elapsed
+        stats.min_time = min(stats.min_time, elapsed)
+        stats.max_time = max(stats.max_time, elapsed)
+        stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        if failed:
+            stats.errors += 1
+
+    def _log_slow_query(self, query: str, args: Sequence[Any], elapsed: float):
+        logger.warning(
+            f"Slow query took {elapsed * 1000:.1f}ms, called from {_find_caller()}: "
+            f"{normalize_query(query)} with args ({', '.join(_arg_shape(a) for a in args)})"
+        )
+
+    def snapshot(self, reset: bool = False) -> list[QueryStats]:
+        """returns the current statistics ordered by total time spent, optionally resetting them"""
+        result = [stats.to_model(query) for query, stats in self._stats.items()]
+        result.sort(key=lambda s: s.total_time, reverse=True)
+        if reset:
+            self.reset()
+        return result
+
+    def reset(self):
+        self._stats.clear()
+
+
+class QueryPlan(BaseModel):
+    query: str
+    # types and lengths of the statement arguments, the values themselves are not stored
+    args: list[str]
+    # duration of the original statement in seconds
+    duration: float
+    captured_at: datetime.datetime
+    caller: str
+    # output of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+    plan: Any
+
+
+class QueryPlans:
+    """
+    Captures the execution plans of slow or sampled statements in a ring buffer holding the `max_plans` most recent
+    plans.
+
+    A statement is captured if it took longer than `threshold` seconds or, independent of its duration, with the
+    probability `sample_rate`. Captured statements are executed a second time with EXPLAIN (ANALYZE, BUFFERS) inside a
+    savepoint which is rolled back afterwards. Side effects outside of the transaction, e.g. advancing sequences, are
+    not rolled back. This doubles the execution time of captured statements, it is meant for debugging.
+    """
+
+    def __init__(self, threshold: float | None = None, sample_rate: float = 0.0, max_plans: int = 100):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._plans: collections.deque[QueryPlan] = collections.deque(maxlen=max_plans)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None or self.sample_rate > 0
+
+    def should_capture(self, query: str, elapsed: float) -> bool:
+        if not (self.threshold is not None and elapsed >= self.threshold) and not (
+            self.sample_rate > 0 and random.random() < self.sample_rate
+        ):
+            return False
+        return _EXPLAINABLE_RE.match(query) is not None
+
+    def add(self, query: str, args: Sequence[Any], elapsed: float, plan: Any):
+        self._plans.append(
+            QueryPlan(
+                query=query,
+                args=[_arg_shape(a) for a in args],
+                duration=elapsed,
+                captured_at=datetime.datetime.now(tz=datetime.timezone.utc),
+                caller=_find_caller(),
+                plan=plan,
+            )
+        )
+
+    def snapshot(self) -> list[QueryPlan]:
+        """returns the captured plans, most recent first"""
+        return list(reversed(self._plans))
+
+    def clear(self):
+        self._plans.clear()
+
+
+class CallSiteStats(BaseModel):
+    call_site: str
+    acquisitions: int
+    total_hold_time: float
+    max_hold_time: float
+    mean_hold_time: float
+
+
+class PoolStats(BaseModel):
+    size: int
+    min_size: int
+    max_size: int
+    in_use: int
+    idle: int
+    acquisitions: int
+    # acquisitions which found no free connection and had to wait for one to be released
+    exhausted: int
+    # acquisitions which timed out
+    timeouts: int
+    total_wait_time: float
+    max_wait_time: float
+    # number of acquisitions per wait time bucket, the bucket bounds are given by LATENCY_BUCKETS
+    wait_histogram: list[int]
+    # time connections were held by the code location which acquired them, ordered by total time
+    hold_times: list[CallSiteStats]
+    # stats of the replica pools by replica name
+    replicas: dict[str, "PoolStats"] = {}
+
+
+class _CallSiteStats:
+    __slots__ = ("acquisitions", "total_hold_time", "max_hold_time")
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.total_hold_time = 0.0
+        self.max_hold_time = 0.0
+
+    def to_model(self, call_site: str) -> CallSiteStats:
+        return CallSiteStats(
+            call_site=call_site,
+            acquisitions=self.acquisitions,
+            total_hold_time=self.total_hold_time,
+            max_hold_time=self.max_hold_time,
+            mean_hold_time=self.total_hold_time / self.acquisitions,
+        )
+
+
+class PoolMetrics:
+    """
+    Collects the time spent waiting for and holding connections of a pool.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.acquisitions = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.wait_histogram = [0] * len(LATENCY_BUCKETS)
+        self._call_sites: dict[str, _CallSiteStats] = {}
+
+    @staticmethod
+    def call_site() -> str:
+        return _find_caller()
+
+    def record_acquire(self, wait: float, exhausted: bool):
+        self.acquisitions += 1
+        self.total_wait_time += wait
+        self.max_wait_time = max(self.max_wait_time, wait)
+        self.wait_histogram[bisect.bisect_left(LATENCY_BUCKETS, wait)] += 1
+        if exhausted:
+            self.exhausted += 1
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def record_release(self, call_site: str, hold_time: float):
+        stats = self._call_sites.get(call_site)
+        if stats is None:
+            if len(self._call_sites) >= MAX_CALL_SITES:
+                call_site = OTHER_CALL_SITES
+            stats = self._call_sites.setdefault(call_site, _CallSiteStats())
+        stats.acquisitions += 1
+        stats.total_hold_time += hold_time
+        stats.max_hold_time = max(stats.max_hold_time, hold_time)
+
+    def snapshot(self, size: int, min_size: int, max_size: int, idle: int, reset: bool = False) -> PoolStats:
+        hold_times = [stats.to_model(call_site) for call_site, stats in self._call_sites.items()]
+        hold_times.sort(key=lambda s: s.total_hold_time, reverse=True)
+        result = PoolStats(
+            size=size,
+            min_size=min_size,
+            max_size=max_size,
+            in_use=size - idle,
+            idle=idle,
+            acquisitions=self.acquisitions,
+            exhausted=self.exhausted,
+            timeouts=self.timeouts,
+            total_wait_time=self.total_wait_time,
+            max_wait_time=self.max_wait_time,
+            wait_histogram=list(self.wait_histogram),
+            hold_times=hold_times,
+        )
+        if reset:
+            self.reset()
+        return result
@@ -0,0 +1,100 @@
+"""
+json / jsonb type codecs for asyncpg connections
+"""
+
+import json
+from typing import Any, Callable, Literal
+
+JsonCodecName = Literal["auto", "json", "orjson", "msgspec"]
+
+# version byte prefixed to every jsonb value in the binary wire format
+_JSONB_VERSION = 1
+
+
+class JsonCodec:
+    """
+    Serialization functions used for json and jsonb columns.
+
+    `dumps` has to return the encoded document as bytes, `loads` has to accept str, bytes and memoryviews.
+    """
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[str | bytes | memoryview], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def encode_text(self, value: Any) -> str:
+        return self.dumps(value).decode("utf-8")
+
+    def decode_text(self, data: str) -> Any:
+        return self.loads(data)
+
+    def encode_json_binary(self, value: Any) -> bytes:
+        return self.dumps(value)
+
+    def decode_json_binary(self, data: bytes) -> Any:
+        return self.loads(data)
+
+    def encode_jsonb_binary(self, value: Any) -> bytes:
+        return bytes((_JSONB_VERSION,)) + self.dumps(value)
+
+    def decode_jsonb_binary(self, data: bytes) -> Any:
+        if data[0] != _JSONB_VERSION:
+            raise ValueError(f"Unsupported jsonb binary format version {data[0]}")
+        return self.loads(memoryview(data)[1:])
+
+
+def _stdlib_codec() -> JsonCodec:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def loads(data: str | bytes | memoryview) -> Any:
+        return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+    return JsonCodec(name="json", dumps=dumps, loads=loads)
+
+
+def _orjson_codec() -> JsonCodec:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        # non str keys are converted to strings to stay compatible with the stdlib json module
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+    return JsonCodec(name="orjson", dumps=dumps, loads=orjson.loads)
+
+
+def _msgspec_codec() -> JsonCodec:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return JsonCodec(name="msgspec", dumps=encoder.encode, loads=decoder.decode)
+
+
+def get_json_codec(name: JsonCodecName) -> JsonCodec:
+    """
+    Return the json codec with the given name.
+
+    "auto" selects the fastest available implementation, preferring orjson over msgspec and falling back to the
+    json module of the standard library.
+
+    orjson and msgspec differ from the json module of the standard library, which is used by default:
+    both encode NaN and Infinity as null, orjson additionally fails to encode integers which do not fit into 64 bits
+    and decodes them as floats, losing precision.
+    """
+    if name == "json":
+        return _stdlib_codec()
+    if name == "orjson":
+        return _orjson_codec()
+    if name == "msgspec":
+        return _msgspec_codec()
+    if name != "auto":
+        raise ValueError(f"Unknown json codec {name}")
+
+    for factory in (_orjson_codec, _msgspec_codec):
+        try:
+            return factory()
+        except ImportError:
+            pass
+    return _stdlib_codec()
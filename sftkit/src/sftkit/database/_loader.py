@@ -0,0 +1,130 @@
+"""
+batching of concurrent single key lookups
+"""
+
+import asyncio
+from typing import TYPE_CHECKING, Generic, Hashable, Iterable, Type, TypeVar
+
+from pydantic import BaseModel
+
+from sftkit.database._mapper import ModelRecord, mapper_for_record
+from sftkit.error import NotFound
+
+if TYPE_CHECKING:
+    from sftkit.database._connection import Connection
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T", bound=BaseModel)
+
+
+class BatchLoader(Generic[K, T]):
+    """
+    Collects all lookups by key issued within the same event loop iteration and resolves them with a single query.
+
+    The query receives the list of requested keys as its only argument and must return the key in the column
+    `key_column`, e.g. `select * from "user" where id = any($1)`.
+    Results are cached for the lifetime of the loader, a loader should therefore be scoped to a single request or
+    transaction, e.g. by creating it inside a service method:
+
+        loader = conn.batch_loader(User, 'select * from "user" where id = any($1)')
+        users = await asyncio.gather(*(loader.load(post.author_id) for post in posts))
+    """
+
+    def __init__(
+        self,
+        conn: "Connection",
+        model: Type[T],
+        query: str,
+        *,
+        key_column: str = "id",
+        max_batch_size: int | None = None,
+        trusted: bool = False,
+    ):
+        self.conn = conn
+        self.model = model
+        self.query = query
+        self.key_column = key_column
+        self.max_batch_size = max_batch_size
+        self.trusted = trusted
+
+        self._cache: dict[K, asyncio.Future[T]] = {}
+        self._pending: dict[K, asyncio.Future[T]] = {}
+        self._dispatch_scheduled = False
+        self._batch_tasks: set[asyncio.Task] = set()
+        # queries on one connection cannot run concurrently
+        self._query_lock = asyncio.Lock()
+
+    def load(self, key: K) -> asyncio.Future[T]:
+        """
+        Returns a future resolving to the model with the given key, raises NotFound if no row exists for the key.
+
+        Every call returns its own future such that cancelling one caller does not affect other callers of the same key.
+        """
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._cache[key] = future
+            self._pending[key] = future
+            if not self._dispatch_scheduled:
+                self._dispatch_scheduled = True
+                loop.call_soon(self._dispatch)
+        return asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[K]) -> list[T]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def clear(self, key: K | None = None):
+        """remove one or all keys from the cache, e.g. after modifying the corresponding rows"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def _dispatch(self):
+        self._dispatch_scheduled = False
+        pending = self._pending
+        self._pending = {}
+        keys = list(pending.keys())
+        batch_size = self.max_batch_size or len(keys)
+        for i in range(0, len(keys), batch_size):
+            batch = {key: pending[key] for key in keys[i : i + batch_size]}
+            task = asyncio.create_task(self._load_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _load_batch(self, batch: dict[K, asyncio.Future[T]]):
+        try:
+            async with self._query_lock:
+                records = await self.conn.fetch(self.query, list(batch.keys()), record_class=ModelRecord)
+            results = {}
+            if len(records) > 0:
+                results = dict(
+                    zip(
+                        (r[self.key_column] for r in records),
+                        mapper_for_record(self.model, records[0], self.trusted).map_many(records),
+                    )
+                )
+        except asyncio.CancelledError:
+            for key, future in batch.items():
+                self._cache.pop(key, None)
+                future.cancel()
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            for key, future in batch.items():
+                # failed lookups are not cached such that they can be retried
+                self._cache.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if future.done():
+                continue
+            if key in results:
+                future.set_result(results[key])
+            else:
+                # missing keys are not cached either, the row might be created later on
+                self._cache.pop(key, None)
+                element_id = key if isinstance(key, (str, int)) else str(key)
+                future.set_exception(NotFound(element_type=self.model.__name__, element_id=element_id))
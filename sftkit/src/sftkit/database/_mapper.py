@@ -0,0 +1,129 @@
+"""
+conversion of asyncpg records to pydantic models
+"""
+
+import functools
+import operator
+from collections.abc import Mapping
+from typing import Any, Callable, Generic, Iterable, Sequence, Type, TypeVar
+
+import asyncpg
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import PydanticUndefined
+
+T = TypeVar("T", bound=BaseModel)
+
+# setters of the slots of pydantic models, bypassing BaseModel.__setattr__
+_set_dict = BaseModel.__dict__["__dict__"].__set__
+_set_fields_set = BaseModel.__dict__["__pydantic_fields_set__"].__set__
+_set_extra = BaseModel.__dict__["__pydantic_extra__"].__set__
+_set_private = BaseModel.__dict__["__pydantic_private__"].__set__
+
+
+class ModelRecord(asyncpg.Record):
+    """
+    Record class used by the Connection fetch helpers.
+
+    It is registered as a Mapping such that pydantic can validate it directly without first copying it into a dict.
+    Note that, as with every asyncpg record, iterating over it yields the values, not the keys.
+    """
+
+
+Mapping.register(ModelRecord)
+
+
+class RowMapper(Generic[T]):
+    """
+    Converter of records with a fixed column layout into instances of a pydantic model.
+
+    In the default mode all rows of a result are validated in one go through a TypeAdapter.
+    In trusted mode validation is skipped entirely and the model instances are built directly from the record values,
+    this must only be used for rows whose types are guaranteed by the database schema to match the model.
+    """
+
+    def __init__(self, model: Type[T], columns: tuple[str, ...], trusted: bool):
+        self.model = model
+        self.columns = columns
+        self.trusted = trusted
+
+        self._list_adapter: TypeAdapter[list[T]] = TypeAdapter(list[model])  # type: ignore[valid-type]
+
+        self._construct: Callable[[asyncpg.Record], T] = self._model_construct
+        if trusted:
+            self._prepare_construct()
+
+    def _model_construct(self, record: asyncpg.Record) -> T:
+        return self.model.model_construct(**record)
+
+    def _prepare_construct(self):
+        """
+        prepare building the model instances by directly setting their attributes, which is considerably faster than
+        model_construct as the mapping from columns to fields is only resolved once.
+        """
+        model = self.model
+        if model.__private_attributes__ or model.model_config.get("extra") == "allow":
+            return
+
+        column_index = {name: i for i, name in enumerate(self.columns)}
+        names: list[str] = []
+        indices: list[int] = []
+        defaults: list[Any] = []
+        for name, field in model.model_fields.items():
+            column = field.alias or name
+            if column in column_index:
+                indices.append(column_index[column])
+            elif field.default is not PydanticUndefined and field.default_factory is None:
+                # defaults are appended to the record values
+                indices.append(len(self.columns) + len(defaults))
+                defaults.append(field.default)
+            else:
+                # missing required fields or default factories are left to model_construct
+                return
+            names.append(name)
+        if not names:
+            return
+
+        # the values of the fields in field order
+        values: Callable[[asyncpg.Record], Iterable[Any]]
+        if not defaults and indices == list(range(len(self.columns))):
+            values = iter
+        elif len(indices) == 1:
+            values = operator.itemgetter(slice(indices[0], indices[0] + 1))
+        else:
+            values = operator.itemgetter(*indices)
+        if defaults:
+            default_values = tuple(defaults)
+            get_values = values
+            values = lambda record: get_values((*record, *default_values))  # noqa: E731
+
+        fields_set = frozenset(name for name, index in zip(names, indices) if index < len(self.columns))
+        new = model.__new__
+
+        def construct(record: asyncpg.Record) -> T:
+            instance = new(model)
+            _set_dict(instance, dict(zip(names, values(record))))
+            _set_fields_set(instance, set(fields_set))
+            _set_extra(instance, None)
+            _set_private(instance, None)
+            return instance
+
+        self._construct = construct
+
+    def map_one(self, record: asyncpg.Record) -> T:
+        if self.trusted:
+            return self._construct(record)
+        return self.model.model_validate(record)
+
+    def map_many(self, records: Sequence[asyncpg.Record]) -> list[T]:
+        if self.trusted:
+            return list(map(self._construct, records))
+        return self._list_adapter.validate_python(records)
+
+
+@functools.lru_cache(maxsize=1024)
+def get_row_mapper(model: Type[T], columns: tuple[str, ...], trusted: bool = False) -> RowMapper[T]:
+    return RowMapper(model, columns, trusted)
+
+
+def mapper_for_record(model: Type[T], record: asyncpg.Record, trusted: bool = False) -> RowMapper[T]:
+    return get_row_mapper(model, tuple(record.keys()), trusted)
@@ -0,0 +1,160 @@
+"""
+multiplexing of pg_notify channels over a single listening connection
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import Callable
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+NotificationCallback = Callable[[asyncpg.Connection, int, str, str], None]
+
+
+class Subscription:
+    def __init__(self, channel: str, callback: NotificationCallback, on_connect: Callable[[], None] | None):
+        self.channel = channel
+        # called like an asyncpg listener with (connection, pid, channel, payload)
+        self.callback = callback
+        # called whenever the listening connection has been (re)established, notifications might have been missed
+        self.on_connect = on_connect
+
+
+class NotificationDispatcher:
+    """
+    Listens on the channels of all subscriptions over one connection obtained from `acquire` and passes the
+    notifications on to the subscriptions of their channel.
+
+    The connection is opened with the first subscription and closed once the last one is cancelled, or for good by
+    `close`, after which subscribing raises a RuntimeError.
+    A lost connection is noticed within `keepalive_interval` seconds and reestablished after `reconnect_delay` seconds.
+    """
+
+    def __init__(
+        self,
+        acquire: Callable[[], contextlib.AbstractAsyncContextManager[asyncpg.Connection]],
+        reconnect_delay: float = 1.0,
+        keepalive_interval: float = 30.0,
+    ):
+        self.acquire = acquire
+        self.reconnect_delay = reconnect_delay
+        self.keepalive_interval = keepalive_interval
+
+        self._subscriptions: dict[str, list[Subscription]] = {}
+        self._conn: asyncpg.Connection | None = None
+        self._connected = asyncio.Event()
+        # serializes changes of the subscriptions and LISTEN and UNLISTEN on the connection
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    @property
+    def channels(self) -> list[str]:
+        return list(self._subscriptions.keys())
+
+    async def subscribe(
+        self, channel: str, callback: NotificationCallback, on_connect: Callable[[], None] | None = None
+    ) -> Subscription:
+        """
+        pass all notifications on channel to callback, returns once the channel is listened to.
+        callback runs inside the listener of the connection and must not block.
+        """
+        subscription = Subscription(channel, callback, on_connect)
+        async with self._lock:
+            if self._closed:
+                raise RuntimeError("The notification dispatcher has been closed")
+            new_channel = channel not in self._subscriptions
+            self._subscriptions.setdefault(channel, []).append(subscription)
+            if new_channel and self._conn is not None:
+                await self._conn.add_listener(channel, self._dispatch)
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+        if self._closed:
+            raise RuntimeError("The notification dispatcher has been closed")
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        async with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if subscriptions:
+                return
+            self._subscriptions.pop(subscription.channel, None)
+            if not self._subscriptions:
+                # the connection is reopened by the next subscription
+                await self._stop()
+            elif self._conn is not None:
+                with contextlib.suppress(asyncpg.InterfaceError, asyncpg.PostgresError, OSError):
+                    await self._conn.remove_listener(subscription.channel, self._dispatch)
+
+    @contextlib.asynccontextmanager
+    async def subscription(
+        self, channel: str, callback: NotificationCallback, on_connect: Callable[[], None] | None = None
+    ):
+        subscription = await self.subscribe(channel, callback, on_connect)
+        try:
+            yield subscription
+        finally:
+            await self.unsubscribe(subscription)
+
+    async def close(self):
+        """stop listening and close the connection for good"""
+        async with self._lock:
+            self._closed = True
+            await self._stop()
+            # wake up subscriptions waiting for the connection
+            self._connected.set()
+
+    async def _stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _dispatch(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        for subscription in list(self._subscriptions.get(channel, [])):
+            try:
+                subscription.callback(connection, pid, channel, payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"Error in notification callback of channel {channel}")
+
+    async def _listen(self):
+        async with self.acquire() as conn:
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            try:
+                async with self._lock:
+                    for channel in self._subscriptions:
+                        await conn.add_listener(channel, self._dispatch)
+                    self._conn = conn
+                self._connected.set()
+                logger.debug(f"Listening on channels {', '.join(self.channels)}")
+                for subscriptions in list(self._subscriptions.values()):
+                    for subscription in subscriptions:
+                        if subscription.on_connect is not None:
+                            subscription.on_connect()
+
+                while not lost.is_set():
+                    with contextlib.suppress(TimeoutError):
+                        await asyncio.wait_for(lost.wait(), timeout=self.keepalive_interval)
+                    if not lost.is_set():
+                        await asyncio.wait_for(conn.execute("select 1"), timeout=self.keepalive_interval)
+            finally:
+                self._connected.clear()
+                self._conn = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+                logger.warning("Lost the connection listening for notifications, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"Error on the connection listening for notifications, reconnecting: {e}")
+            await asyncio.sleep(self.reconnect_delay)
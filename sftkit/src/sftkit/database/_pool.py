@@ -1,56 +1,278 @@
 import asyncio
+import contextlib
+import functools
 import logging
 import ssl
-from typing import Literal
+import time
+import traceback
+from typing import AsyncIterator, Awaitable, Callable, Literal
 
 import asyncpg
 
 from sftkit.database._config import DatabaseConfig
 from sftkit.database._connection import Connection, init_connection
+from sftkit.database._instrumentation import PoolMetrics, PoolStats, QueryPlans, QueryStatistics
+from sftkit.database._json import get_json_codec
+from sftkit.database._notifications import NotificationDispatcher
+from sftkit.database._replicas import Replica, ReplicaSet, parse_replica_host
+from sftkit.database._scope import current_scope
+from sftkit.database._type_cache import TypeCache
 
 logger = logging.getLogger(__name__)
 
-Pool = asyncpg.Pool
 
+class Pool(asyncpg.Pool):
+    """
+    asyncpg connection pool of sftkit Connections.
+
+    `query_statistics` aggregates the statement statistics of all connections in the pool,
+    `query_plans` holds the captured plans of slow statements, `metrics` the acquire wait and connection hold times,
+    `stats()` returns a snapshot of the pool metrics. `type_cache` holds the types shared by all connections.
+
+    Connections which have been open for longer than `max_connection_lifetime` seconds are closed when they are
+    released instead of being returned to the pool, a new connection is opened on demand.
 
-async def create_db_pool(cfg: DatabaseConfig, n_connections: int) -> asyncpg.Pool:
+    If replicas are configured, `acquire_read_only` hands out connections to a replica, see ReplicaSet.
+
+    `direct_connect` opens connections outside of the pool, to the database server itself behind a transaction
+    pooler, see `acquire_direct`. `notifications` listens for the notifications of all DatabaseHooks on the pool
+    over one such connection.
+    With `debug_nested_acquire` acquiring a connection from within a connection_scope is logged.
     """
-    get a connection pool to the database
+
+    def __init__(
+        self,
+        *args,
+        query_statistics: QueryStatistics,
+        query_plans: QueryPlans,
+        metrics: PoolMetrics,
+        type_cache: TypeCache | None = None,
+        max_connection_lifetime: float | None = None,
+        direct_connect: Callable[[], Awaitable[Connection]] | None = None,
+        debug_nested_acquire: bool = False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.type_cache = type_cache
+        self.query_statistics = query_statistics
+        self.query_plans = query_plans
+        self.metrics = metrics
+        self.max_connection_lifetime = max_connection_lifetime
+        self.replicas: ReplicaSet | None = None
+        self.direct_connect = direct_connect
+        self.debug_nested_acquire = debug_nested_acquire
+        self.notifications = NotificationDispatcher(self.acquire_direct)
+
+    def acquire_read_only(self, *, timeout: float | None = None) -> contextlib.AbstractAsyncContextManager:
+        """acquire a connection for a read only transaction, from a replica if available"""
+        if self.replicas is None:
+            return self.acquire(timeout=timeout)
+        return self.replicas.acquire(fallback=self, timeout=timeout)
+
+    @contextlib.asynccontextmanager
+    async def acquire_direct(self) -> AsyncIterator[Connection]:
+        """
+        open a connection outside of the pool with a session of its own, e.g. for LISTEN, which is closed afterwards.
+        behind a transaction pooler it connects to the database server itself.
+        without `direct_connect` a connection is acquired from the pool instead.
+        """
+        if self.direct_connect is None:
+            async with self.acquire() as conn:
+                yield conn
+            return
+
+        conn = await self.direct_connect()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    async def expire_connections(self):
+        if self.type_cache is not None:
+            self.type_cache.clear()
+        await super().expire_connections()
+
+    async def close(self):
+        await self.notifications.close()
+        if self.replicas is not None:
+            await self.replicas.close()
+        await super().close()
+
+    def terminate(self):
+        if self.replicas is not None:
+            self.replicas.terminate()
+        super().terminate()
+
+    def stats(self, reset: bool = False) -> PoolStats:
+        """current pool utilisation and the collected pool metrics, optionally resetting the latter"""
+        stats = self.metrics.snapshot(
+            size=self.get_size(),
+            min_size=self.get_min_size(),
+            max_size=self.get_max_size(),
+            idle=self.get_idle_size(),
+            reset=reset,
+        )
+        if self.replicas is not None:
+            stats.replicas = {r.name: r.pool.stats(reset=reset) for r in self.replicas.replicas}
+        return stats
+
+    async def _acquire(self, timeout):
+        if self.debug_nested_acquire and current_scope() is not None:
+            stack = "".join(traceback.format_stack(limit=10)[:-1])
+            logger.warning(f"Nested acquire of a database connection while the task already holds one:\n{stack}")
+
+        if not self.metrics.enabled:
+            return await super()._acquire(timeout)
+
+        exhausted = self.get_idle_size() == 0 and self.get_size() >= self.get_max_size()
+        start = time.perf_counter()
+        try:
+            proxy = await super()._acquire(timeout)
+        except asyncio.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        acquired_at = time.perf_counter()
+        self.metrics.record_acquire(acquired_at - start, exhausted=exhausted)
+        con = proxy._con  # pylint: disable=protected-access
+        if isinstance(con, Connection):
+            con.acquired_at = acquired_at
+            con.acquired_by = self.metrics.call_site()
+        return proxy
+
+    async def release(self, connection, *, timeout=None):
+        con = getattr(connection, "_con", None)  # None if the proxy has already been released
+        if isinstance(con, Connection) and con.acquired_by is not None:
+            self.metrics.record_release(
+                con.acquired_by,
+                time.perf_counter() - con.acquired_at,
+            )
+            con.acquired_by = None
+        if (
+            self.max_connection_lifetime is not None
+            and isinstance(con, Connection)
+            and not con.is_closed()
+            and time.monotonic() - con.created_at > self.max_connection_lifetime
+        ):
+            # closing the connection returns its slot to the pool, shielded like asyncpg's own release
+            await asyncio.shield(con.close(timeout=timeout))
+        return await super().release(connection, timeout=timeout)
+
+
+def _connect_args(cfg: DatabaseConfig) -> dict:
+    """arguments to asyncpg.connect shared by pooled and standalone connections"""
+    sslctx: ssl.SSLContext | Literal["verify-full", "prefer"] | None
+    if cfg.sslrootcert and cfg.require_ssl:
+        sslctx = ssl.create_default_context(
+            ssl.Purpose.SERVER_AUTH,
+            cafile=cfg.sslrootcert,
+        )
+        sslctx.check_hostname = True
+    else:
+        sslctx = "verify-full" if cfg.require_ssl else "prefer"
+
+    args: dict = dict(
+        user=cfg.user,
+        password=cfg.password,
+        database=cfg.dbname,
+        host=cfg.host,
+        port=cfg.port,
+        ssl=sslctx,
+        # the introspection query of asyncpg (defined as introspection.INTRO_LOOKUP_TYPES)
+        # can take 1s with the jit.
+        # the introspection is triggered to create converters for unknown types,
+        # for example the integer[] (oid = 1007).
+        # see https://github.com/MagicStack/asyncpg/issues/530
+        server_settings={"jit": "off"},
+    )
+    if cfg.transaction_pooling:
+        # poolers reject unknown startup parameters
+        del args["server_settings"]
+        if not cfg.pooler_prepared_statements:
+            # only use unnamed statements, which do not outlive the transaction
+            args["statement_cache_size"] = 0
+    return args
+
+
+async def _connect_pool(cfg: DatabaseConfig, n_connections: int, min_connections: int) -> Pool:
+    json_codec = get_json_codec(cfg.json_codec)
+    query_statistics = QueryStatistics(
+        enabled=cfg.collect_query_statistics, slow_query_threshold=cfg.slow_query_threshold
+    )
+    collect_statistics = cfg.collect_query_statistics or cfg.slow_query_threshold is not None
+    query_plans = QueryPlans(
+        threshold=cfg.explain_threshold, sample_rate=cfg.explain_sample_rate, max_plans=cfg.explain_max_plans
+    )
+    type_cache = TypeCache() if cfg.warm_type_cache else None
+
+    return await Pool(
+        **_connect_args(cfg),
+        max_size=n_connections,
+        connection_class=Connection,
+        min_size=min_connections,
+        init=functools.partial(
+            init_connection,
+            json_codec=json_codec,
+            json_binary_format=cfg.json_binary_format,
+            query_statistics=query_statistics if collect_statistics else None,
+            query_plans=query_plans if query_plans.enabled else None,
+            type_cache=type_cache,
+            scoped_statements=cfg.transaction_pooling and not cfg.pooler_prepared_statements,
+        ),
+        max_inactive_connection_lifetime=cfg.max_idle_time,
+        max_connection_lifetime=cfg.max_connection_lifetime,
+        # defaults of asyncpg.create_pool
+        max_queries=50000,
+        loop=None,
+        record_class=asyncpg.Record,
+        query_statistics=query_statistics,
+        query_plans=query_plans,
+        metrics=PoolMetrics(enabled=cfg.collect_pool_metrics),
+        debug_nested_acquire=cfg.debug_nested_acquire,
+        direct_connect=functools.partial(asyncpg.connect, **_connect_args(cfg.direct()), connection_class=Connection),
+        type_cache=type_cache,
+    )
+
+
+async def _create_replica_set(cfg: DatabaseConfig, n_connections: int, min_connections: int) -> ReplicaSet:
+    replicas = []
+    for replica_host in cfg.replica_hosts:
+        host, port = parse_replica_host(replica_host, default_port=cfg.port)
+        replica_cfg = cfg.model_copy(update={"host": host, "port": port, "replica_hosts": []})
+        try:
+            pool = await _connect_pool(replica_cfg, n_connections=n_connections, min_connections=min_connections)
+        except (OSError, asyncpg.PostgresError) as e:
+            # unavailable replicas must not prevent startup, the connections are opened once the replica is back
+            logger.warning(f"Failed to connect to replica {replica_host}: {e}")
+            pool = await _connect_pool(replica_cfg, n_connections=n_connections, min_connections=0)
+        replicas.append(
+            Replica(
+                name=replica_host, pool=pool, connect=functools.partial(asyncpg.connect, **_connect_args(replica_cfg))
+            )
+        )
+
+    replica_set = ReplicaSet(replicas, max_lag=cfg.max_replica_lag, lag_check_interval=cfg.replica_lag_check_interval)
+    await replica_set.check_lag()
+    replica_set.start()
+    return replica_set
+
+
+async def create_db_pool(cfg: DatabaseConfig, n_connections: int, min_connections: int | None = None) -> Pool:
+    """
+    get a connection pool to the database holding up to n_connections connections.
+
+    min_connections defaults to DatabaseConfig.min_connections, if neither is set all n_connections are kept open.
+    Pools to the configured replicas are created with the same sizes.
     """
     pool = None
+    if min_connections is None:
+        min_connections = cfg.min_connections if cfg.min_connections is not None else n_connections
+    min_connections = min(min_connections, n_connections)
 
     retry_counter = 0
     next_log_at_retry = 0
     while pool is None:
         try:
-            sslctx: ssl.SSLContext | Literal["verify-full", "prefer"] | None
-            if cfg.sslrootcert and cfg.require_ssl:
-                sslctx = ssl.create_default_context(
-                    ssl.Purpose.SERVER_AUTH,
-                    cafile=cfg.sslrootcert,
-                )
-                sslctx.check_hostname = True
-            else:
-                sslctx = "verify-full" if cfg.require_ssl else "prefer"
-
-            pool = await asyncpg.create_pool(
-                user=cfg.user,
-                password=cfg.password,
-                database=cfg.dbname,
-                host=cfg.host,
-                port=cfg.port,
-                max_size=n_connections,
-                connection_class=Connection,
-                min_size=n_connections,
-                ssl=sslctx,
-                # the introspection query of asyncpg (defined as introspection.INTRO_LOOKUP_TYPES)
-                # can take 1s with the jit.
-                # the introspection is triggered to create converters for unknown types,
-                # for example the integer[] (oid = 1007).
-                # see https://github.com/MagicStack/asyncpg/issues/530
-                server_settings={"jit": "off"},
-                init=init_connection,
-            )
+            pool = await _connect_pool(cfg, n_connections=n_connections, min_connections=min_connections)
         except Exception as e:  # pylint: disable=broad-except
             sleep_amount = 10
             if next_log_at_retry == retry_counter:
@@ -62,4 +284,7 @@ async def create_db_pool(cfg: DatabaseConfig, n_connections: int) -> asyncpg.Poo
             next_log_at_retry = min(retry_counter * 2, 2**9)
             await asyncio.sleep(sleep_amount)
 
+    if cfg.replica_hosts:
+        pool.replicas = await _create_replica_set(cfg, n_connections=n_connections, min_connections=min_connections)
+
     return pool
@@ -0,0 +1,173 @@
+"""
+routing of read only transactions to replica servers
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+
+import asyncpg
+
+if TYPE_CHECKING:
+    from sftkit.database._pool import Pool
+
+logger = logging.getLogger(__name__)
+
+# replication lag in seconds, 0 if the replica has replayed everything it received or is not in recovery.
+# a standby without a streaming WAL receiver replays everything it has while falling further behind, the lag is
+# unknown then and NULL is returned. the receiver notices a silent primary itself after wal_receiver_timeout.
+# roles without pg_read_all_stats only see the pid of the receiver, its existence has to suffice for them.
+REPLICATION_LAG_QUERY = """
+select case
+    when not pg_is_in_recovery() then 0
+    when not exists (select from pg_stat_wal_receiver where coalesce(status, 'streaming') = 'streaming') then null
+    when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() then 0
+    else coalesce(extract(epoch from now() - pg_last_xact_replay_timestamp()), 0)
+end::float8
+"""
+
+
+def parse_replica_host(replica: str, default_port: int | None) -> tuple[str, int | None]:
+    """split a replica given as "host" or "host:port", ipv6 addresses with a port have to be given as "[addr]:port" """
+    if replica.startswith("["):
+        host, _, port = replica[1:].partition("]:")
+        return host.rstrip("]"), int(port) if port else default_port
+    if replica.count(":") == 1:
+        host, port = replica.split(":")
+        return host, int(port)
+    return replica, default_port
+
+
+class Replica:
+    """
+    `connect` opens a connection outside of the pool used to check the replication lag, such that a busy pool is not
+    mistaken for an unavailable replica.
+    """
+
+    def __init__(self, name: str, pool: "Pool", connect: Callable[[], Awaitable[asyncpg.Connection]]):
+        self.name = name
+        self.pool = pool
+        self.connect = connect
+        self.probe_conn: asyncpg.Connection | None = None
+        # number of currently held or pending acquisitions routed to this replica
+        self.outstanding = 0
+        self.acquisitions = 0
+        # replication lag in seconds, None if the replica is not reachable
+        self.lag: float | None = None
+
+
+class ReplicaSet:
+    """
+    Routes read only transactions to the replica with the least outstanding acquisitions.
+
+    Replicas which are not reachable or lag behind the primary by more than `max_lag` seconds are skipped, if no
+    replica can be used the primary is used instead. The lag is checked every `lag_check_interval` seconds.
+    Transactions on a replica might not see writes which have just been committed on the primary.
+    """
+
+    def __init__(self, replicas: list[Replica], max_lag: float | None, lag_check_interval: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._monitor_task: asyncio.Task | None = None
+
+    async def check_lag(self):
+        for replica in self.replicas:
+            try:
+                async with asyncio.timeout(self.lag_check_interval):
+                    if replica.probe_conn is None or replica.probe_conn.is_closed():
+                        replica.probe_conn = await replica.connect()
+                    lag = await replica.probe_conn.fetchval(REPLICATION_LAG_QUERY)
+            except (OSError, TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                if replica.lag is not None:
+                    logger.warning(f"Replica {replica.name} is not available, routing reads elsewhere: {e!r}")
+                if replica.probe_conn is not None:
+                    replica.probe_conn.terminate()
+                    replica.probe_conn = None
+                lag = None
+            else:
+                if lag is None and replica.lag is not None:
+                    logger.warning(
+                        f"Replica {replica.name} does not receive WAL from the primary, routing reads elsewhere"
+                    )
+            self._set_lag(replica, lag)
+
+    def _set_lag(self, replica: Replica, lag: float | None):
+        was_usable = self._is_usable(replica)
+        replica.lag = lag
+        if was_usable and not self._is_usable(replica) and lag is not None:
+            logger.warning(f"Replica {replica.name} lags behind by {lag:.1f}s, routing reads elsewhere")
+
+    def _is_usable(self, replica: Replica) -> bool:
+        return replica.lag is not None and (self.max_lag is None or replica.lag <= self.max_lag)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.lag_check_interval)
+            await self.check_lag()
+
+    def start(self):
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    def choose(self) -> Replica | None:
+        candidates = [r for r in self.replicas if self._is_usable(r)]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda r: (r.outstanding, r.acquisitions))
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, fallback: "Pool", timeout: float | None = None) -> AsyncIterator:
+        replica = self.choose()
+        conn = None
+        if replica is not None:
+            replica.outstanding += 1
+            replica.acquisitions += 1
+            try:
+                conn = await replica.pool.acquire(timeout=timeout)
+            except TimeoutError:
+                # TimeoutError is an OSError, but an exhausted pool does not make the replica unavailable
+                replica.outstanding -= 1
+                raise
+            except (OSError, asyncpg.PostgresConnectionError) as e:
+                replica.outstanding -= 1
+                self._set_lag(replica, None)
+                logger.warning(f"Failed to connect to replica {replica.name}, falling back to the primary: {e}")
+            except BaseException:
+                # e.g. cancellation or acquire timeouts
+                replica.outstanding -= 1
+                raise
+
+        if replica is None or conn is None:
+            async with fallback.acquire(timeout=timeout) as fallback_conn:
+                yield fallback_conn
+            return
+
+        try:
+            yield conn
+        finally:
+            replica.outstanding -= 1
+            await replica.pool.release(conn)
+
+    async def _stop_monitor(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._monitor_task
+            self._monitor_task = None
+
+    async def close(self):
+        await self._stop_monitor()
+        for replica in self.replicas:
+            if replica.probe_conn is not None:
+                await replica.probe_conn.close()
+                replica.probe_conn = None
+        await asyncio.gather(*(r.pool.close() for r in self.replicas))
+
+    def terminate(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        for replica in self.replicas:
+            if replica.probe_conn is not None:
+                replica.probe_conn.terminate()
+            replica.pool.terminate()
@@ -0,0 +1,64 @@
+"""
+tracking of the connection held by the current task
+"""
+
+import asyncio
+import contextlib
+import contextvars
+from typing import Iterator
+
+from sftkit.database._connection import Connection
+
+
+class ConnectionScope:
+    def __init__(self, conn: Connection, read_only: bool):
+        self.conn = conn
+        # the connection might be a replica or in a read only transaction and must not be used for writes
+        self.read_only = read_only
+        # context variables are inherited by tasks created in the scope, which must not share the connection
+        self.task = asyncio.current_task()
+        # results of memoized calls within the scope, cleared by writes
+        self.memo: dict = {}
+
+
+_current_scope: contextvars.ContextVar[ConnectionScope | None] = contextvars.ContextVar(
+    "sftkit_connection_scope", default=None
+)
+
+
+@contextlib.contextmanager
+def connection_scope(conn: Connection, read_only: bool = False) -> Iterator[ConnectionScope]:
+    """
+    make conn the connection of the current task until the context is left, see current_connection.
+    if the task already holds conn the enclosing scope is kept.
+    """
+    scope = current_scope()
+    if scope is not None and scope.conn is conn:
+        yield scope
+        return
+
+    scope = ConnectionScope(conn, read_only=read_only)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope() -> ConnectionScope | None:
+    """the connection scope of the current task, if any"""
+    scope = _current_scope.get()
+    if scope is None or scope.task is not asyncio.current_task():
+        return None
+    return scope
+
+
+def current_connection(read_only: bool = False) -> Connection | None:
+    """
+    the connection held by the current task within a connection_scope, e.g. by a service method, None if there is
+    none or it is read only and `read_only` is not set
+    """
+    scope = current_scope()
+    if scope is None or (scope.read_only and not read_only):
+        return None
+    return scope.conn
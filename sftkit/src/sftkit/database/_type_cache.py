@@ -0,0 +1,81 @@
+"""
+type introspection shared between the connections of a pool
+"""
+
+import asyncio
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# types asyncpg has no builtin codec for and would otherwise introspect on first use: arrays of builtin types and all
+# enums, standalone composite types, domains and ranges of the application schemas, including their arrays
+WARM_TYPES_QUERY = """
+with app_types as (
+    select t.oid
+    from pg_catalog.pg_type t
+        join pg_catalog.pg_namespace ns on ns.oid = t.typnamespace
+        left join pg_catalog.pg_class c on c.oid = t.typrelid
+    where ns.nspname not in ('pg_catalog', 'information_schema')
+        and ns.nspname not like 'pg\\_toast%'
+        and ns.nspname not like 'pg\\_temp%'
+        and (t.typtype in ('e', 'd', 'r', 'm') or (t.typtype = 'c' and c.relkind = 'c'))
+)
+select oid from app_types
+union
+select t.oid
+from pg_catalog.pg_type t
+    join pg_catalog.pg_type elem on elem.oid = t.typelem
+where t.typcategory = 'A'
+    and (
+        -- the row types of system catalogs cannot be decoded
+        (elem.typnamespace = 'pg_catalog'::regnamespace and elem.typtype in ('b', 'r', 'm'))
+        or elem.oid in (select oid from app_types)
+    )
+"""
+
+
+def _register_types(conn: asyncpg.Connection, types: list):
+    conn._protocol.get_settings().register_data_types(types)  # pylint: disable=protected-access
+
+
+class TypeCache:
+    """
+    Introspects the types used by the application once and registers them on every new connection of a pool.
+
+    asyncpg introspects every type it has no builtin codec for, e.g. integer[] or enums, on its first use on each
+    connection. Doing so once per pool removes this latency from the first requests after a deploy or pool growth.
+    Types created after the cache has been loaded are still introspected on first use. After schema changes `clear`
+    has to be called such that connections opened afterwards do not use outdated type definitions, this is done by
+    Pool.expire_connections and after applying migrations or reloading the database code through Database.
+    """
+
+    def __init__(self):
+        self._types: list | None = None
+        self._lock = asyncio.Lock()
+
+    async def _load(self, conn: asyncpg.Connection) -> list:
+        async with self._lock:
+            if self._types is None:
+                oids = [row["oid"] for row in await conn.fetch(WARM_TYPES_QUERY)]
+                # private asyncpg api, this is how asyncpg resolves unknown types when preparing statements
+                types, _ = await conn._introspect_types(oids, timeout=None)  # pylint: disable=protected-access
+                try:
+                    _register_types(conn, types)
+                except asyncpg.UnsupportedClientFeatureError as e:
+                    # leave the introspection of the types to asyncpg on their first use
+                    logger.warning(f"Failed to load the type cache: {e}")
+                    types = []
+                self._types = list(types)
+                logger.debug(f"Loaded {len(self._types)} types into the type cache")
+            return self._types
+
+    async def register(self, conn: asyncpg.Connection):
+        if self._types is None:
+            await self._load(conn)
+        else:
+            _register_types(conn, self._types)
+
+    def clear(self):
+        self._types = None
@@ -62,3 +62,16 @@ class Unauthorized(ServiceException):
 
     def __str__(self):
         return self.msg
+
+
+class ConnectionBudgetExhausted(Exception):
+    """
+    raised, when no database connection could be acquired within the acquire timeout of a connection budget
+    """
+
+    def __init__(self, budget_name: str, timeout: float | None):
+        self.budget_name = budget_name
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"No database connection available in budget {self.budget_name} within {self.timeout}s"
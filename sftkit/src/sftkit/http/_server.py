@@ -13,6 +13,9 @@ from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
 
+from sftkit.database import Pool, PoolStats
+from sftkit.error import ConnectionBudgetExhausted
+
 from ._config import HTTPServerConfig
 from ._context import ContextMiddleware
 from ._error import (
@@ -64,6 +67,7 @@ class Server(Generic[ContextT]):
         )
         self.api.add_exception_handler(asyncpg.exceptions.DeadlockDetectedError, try_again_later_exception_handler)
         self.api.add_exception_handler(asyncpg.exceptions.SerializationError, try_again_later_exception_handler)
+        self.api.add_exception_handler(ConnectionBudgetExhausted, try_again_later_exception_handler)
         self.api.add_exception_handler(asyncpg.exceptions.RaiseError, bad_request_exception_handler)
         self.api.add_exception_handler(Exception, catchall_exception_handler)
 
@@ -97,6 +101,16 @@ class Server(Generic[ContextT]):
         self.api.include_router(router)
         use_route_names_as_operation_ids(self.api)
 
+    def add_pool_metrics_route(self, db_pool: Pool, path: str = "/metrics/db-pool"):
+        """
+        publish the utilisation and metrics of the given database pool, see DatabaseConfig.collect_pool_metrics.
+        """
+
+        async def db_pool_metrics() -> PoolStats:
+            return db_pool.stats()
+
+        self.api.add_api_route(path, db_pool_metrics, methods=["GET"], include_in_schema=False)
+
     def add_task(self, task: asyncio.Task):
         self.tasks.append(task)
 
@@ -0,0 +1,181 @@
+"""
+retry policies for transactions failing due to concurrent transactions
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Literal, Sequence, TypeVar
+
+import asyncpg
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+BackoffName = Literal["exponential", "decorrelated"]
+
+RETRYABLE_ERRORS: tuple[type[asyncpg.PostgresError], ...] = (
+    asyncpg.exceptions.SerializationError,
+    asyncpg.exceptions.DeadlockDetectedError,
+)
+# errors after which rolling back to a savepoint and retrying the work since then can succeed. serialization failures
+# are not among them, the retried work would see the same snapshot and the whole transaction has to be retried
+SAVEPOINT_RETRYABLE_ERRORS: tuple[type[asyncpg.PostgresError], ...] = (
+    asyncpg.exceptions.DeadlockDetectedError,
+    asyncpg.exceptions.LockNotAvailableError,
+)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting the number of retries of all policies sharing it, such that retries cannot multiply the
+    load on the database while it is contended.
+
+    Every call deposits `ratio` tokens, every retry withdraws one token, additionally `min_per_second` tokens are
+    deposited per second such that rarely called code can still retry. At most `max_tokens` are stored.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._last_refill = time.monotonic()
+
+    def _deposit(self, tokens: float):
+        self._tokens = min(self.max_tokens, self._tokens + tokens)
+
+    def record_call(self):
+        self._deposit(self.ratio)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self._deposit((now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RetryStats(BaseModel):
+    # qualified name of the retried function, e.g. the service method
+    name: str
+    sqlstate: str
+    retries: int
+    # number of calls which failed with this error after retrying was given up
+    exhausted: int
+
+
+class RetryStatistics:
+    """retries per retried function and SQLSTATE of the error causing them, to find contended rows"""
+
+    def __init__(self):
+        self._stats: dict[tuple[str, str], list[int]] = {}
+
+    def record(self, name: str, sqlstate: str, exhausted: bool = False):
+        stats = self._stats.setdefault((name, sqlstate), [0, 0])
+        stats[1 if exhausted else 0] += 1
+
+    def snapshot(self, reset: bool = False) -> list[RetryStats]:
+        result = [
+            RetryStats(name=name, sqlstate=sqlstate, retries=retries, exhausted=exhausted)
+            for (name, sqlstate), (retries, exhausted) in self._stats.items()
+        ]
+        if reset:
+            self.reset()
+        return sorted(result, key=lambda s: s.retries, reverse=True)
+
+    def reset(self):
+        self._stats = {}
+
+
+# shared by all policies which do not get a budget or statistics of their own
+retry_budget = RetryBudget()
+retry_statistics = RetryStatistics()
+
+
+class RetryPolicy:
+    """
+    Decides whether and after which delay a call failing with one of the `retryable` errors is retried.
+
+    A call is attempted at most `max_attempts` times and is not retried anymore once `time_budget` seconds would
+    have passed after the next delay, or the retry budget is used up.
+    The delay between attempts grows exponentially from `base_delay` up to `max_delay` seconds, either with full
+    jitter ("exponential") or with decorrelated jitter ("decorrelated") where each delay is drawn between
+    `base_delay` and three times the previous delay.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_attempts: int = 10,
+        backoff: BackoffName = "decorrelated",
+        base_delay: float = 0.001,
+        max_delay: float = 1.0,
+        time_budget: float | None = None,
+        budget: RetryBudget | None = None,
+        statistics: RetryStatistics | None = None,
+        retryable: Sequence[type[Exception]] = RETRYABLE_ERRORS,
+        savepoint_retryable: Sequence[type[Exception]] = SAVEPOINT_RETRYABLE_ERRORS,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least one")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.time_budget = time_budget
+        self.budget = budget or retry_budget
+        self.statistics = statistics or retry_statistics
+        self.retryable = tuple(retryable)
+        self.savepoint_retryable = tuple(savepoint_retryable)
+
+    def next_delay(self, attempt: int, previous_delay: float) -> float:
+        """delay in seconds before the attempt following the given failed attempt, counted from one"""
+        if self.backoff == "exponential":
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
+
+    def _may_retry(self, attempt: int, max_attempts: int, elapsed: float) -> bool:
+        if attempt >= max_attempts:
+            return False
+        if self.time_budget is not None and elapsed > self.time_budget:
+            return False
+        return self.budget.try_withdraw()
+
+    async def run(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[R]],
+        max_attempts: int | None = None,
+        savepoint: bool = False,
+    ) -> R:
+        """
+        call func until it succeeds or retrying is given up, `max_attempts` overrides the one of the policy.
+        with `savepoint` func only runs a part of a transaction inside a savepoint and only the errors which can
+        be recovered from by rolling back to it are retried, all others are left to the enclosing transaction.
+        """
+        max_attempts = max_attempts or self.max_attempts
+        retryable = self.savepoint_retryable if savepoint else self.retryable
+        self.budget.record_call()
+        start = time.monotonic()
+        delay = 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await func()
+            except retryable as e:
+                sqlstate = getattr(e, "sqlstate", None) or type(e).__name__
+                delay = self.next_delay(attempt, delay)
+                if not self._may_retry(attempt, max_attempts, time.monotonic() - start + delay):
+                    self.statistics.record(name, sqlstate, exhausted=True)
+                    logger.warning(f"Giving up {name} after {attempt} attempts, failed with {sqlstate}: {e}")
+                    raise
+                self.statistics.record(name, sqlstate)
+                logger.debug(f"Retrying {name} in {delay:.3f}s after it failed with {sqlstate}")
+            await asyncio.sleep(delay)
@@ -1,25 +1,64 @@
 import asyncio
-import logging
+import contextlib
 import typing
 from abc import ABC
 from functools import wraps
 from inspect import Parameter, signature
-from random import random
-from typing import Awaitable, Callable, Concatenate, Generic, ParamSpec, TypeVar, overload
+from typing import Awaitable, Callable, Concatenate, Generic, Literal, ParamSpec, TypeVar, overload
 
-import asyncpg
-
-from sftkit.database import Pool
+from sftkit.database import Connection, ConnectionScope, Pool, connection_scope, current_connection, current_scope
+from sftkit.error import ConnectionBudgetExhausted
+from sftkit.retry import RetryPolicy
 
 T = TypeVar("T")
 
 
+class ConnectionBudget:
+    """
+    Bounds the number of connections a service or a single service method holds at the same time (a bulkhead), such
+    that a slow code path cannot starve the rest of the application of database connections.
+
+    Callers wait at most `acquire_timeout` seconds for a connection, both for a free slot in the budget and for the
+    pool itself, afterwards ConnectionBudgetExhausted is raised which the http server turns into a 503.
+    """
+
+    def __init__(self, name: str, max_connections: int | None = None, acquire_timeout: float | None = None):
+        self.name = name
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self._semaphore = asyncio.Semaphore(max_connections) if max_connections is not None else None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, acquire: contextlib.AbstractAsyncContextManager):
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                async with asyncio.timeout(self.acquire_timeout):
+                    if self._semaphore is not None:
+                        await stack.enter_async_context(self._semaphore)
+                    conn = await stack.enter_async_context(acquire)
+            except TimeoutError:
+                raise ConnectionBudgetExhausted(self.name, self.acquire_timeout) from None
+            yield conn
+
+
 class Service(ABC, Generic[T]):
-    def __init__(self, db_pool: Pool, config: T, transaction_retries: int | None = None):
+    def __init__(
+        self,
+        db_pool: Pool,
+        config: T,
+        transaction_retries: int | None = None,
+        *,
+        connection_budget: ConnectionBudget | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ):
         self.db_pool = db_pool
         self.config = config
+        # budget for all database connections acquired by this service which do not have their own
+        self.connection_budget = connection_budget
 
         self.default_transaction_retries = transaction_retries or 10
+        # retries of serializable transactions failing due to concurrent transactions
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=self.default_transaction_retries)
 
 
 R = TypeVar("R")
@@ -28,18 +67,15 @@ P = ParamSpec("P")
 
 _READONLY_KWARG_NAME = "__read_only__"
 
-
-def _is_func_read_only(kwargs, func):
-    is_readonly = kwargs.get(_READONLY_KWARG_NAME, False)
-    if _READONLY_KWARG_NAME not in signature(func).parameters:
-        kwargs.pop(_READONLY_KWARG_NAME)
-
-    return is_readonly
+# "snapshot": REPEATABLE READ READ ONLY, all statements see the same snapshot, runs on a replica if available
+# "serializable": SERIALIZABLE READ ONLY DEFERRABLE, waits for a snapshot which is consistent with all serializable
+#   transactions, e.g. for reports, afterwards no predicate locks are taken. always runs on the primary and is never
+#   retried as it cannot fail due to concurrent transactions
+ReadOnlyMode = Literal["snapshot", "serializable"]
 
 
-def _add_readonly_to_kwargs(read_only: bool, kwargs, func):
-    if _READONLY_KWARG_NAME in signature(func).parameters:
-        kwargs[_READONLY_KWARG_NAME] = read_only
+def _accepts_read_only(func) -> bool:
+    return _READONLY_KWARG_NAME in signature(func).parameters
 
 
 def _add_arg_to_signature(original_func, new_func, name: str, annotation):
@@ -51,58 +87,123 @@ def _add_arg_to_signature(original_func, new_func, name: str, annotation):
     new_func.__signature__ = sig  # type: ignore
 
 
+def _acquire_connection(
+    service: Service, read_only: bool, budget: ConnectionBudget | None
+) -> contextlib.AbstractAsyncContextManager:
+    if read_only and isinstance(service.db_pool, Pool):
+        acquire = service.db_pool.acquire_read_only()
+    else:
+        acquire = service.db_pool.acquire()
+
+    budget = budget or service.connection_budget
+    if budget is None:
+        return acquire
+    return budget.acquire(acquire)
+
+
 def with_db_connection(
     func: Callable[Concatenate[Self, P], Awaitable[R]],
 ) -> Callable[Concatenate[Self, P], Awaitable[R]]:
     @wraps(func)
     async def wrapper(self, *args: P.args, **kwargs: P.kwargs):
         if "conn" in kwargs:
-            return await func(self, *args, **kwargs)
+            with connection_scope(typing.cast(Connection, kwargs["conn"])):
+                return await func(self, *args, **kwargs)
 
-        async with self.db_pool.acquire() as conn:
+        conn = current_connection()
+        if conn is not None:
             return await func(self, *args, conn=conn, **kwargs)
 
+        async with _acquire_connection(self, read_only=False, budget=None) as conn:
+            with connection_scope(conn):
+                return await func(self, *args, conn=conn, **kwargs)
+
     return wrapper
 
 
 def _with_db_isolation_transaction(
-    func: Callable[Concatenate[Self, P], Awaitable[R]], read_only: bool, n_retries: int | None = None
+    func: Callable[Concatenate[Self, P], Awaitable[R]],
+    read_only: bool,
+    n_retries: int | None = None,
+    budget: ConnectionBudget | None = None,
+    retry_policy: RetryPolicy | None = None,
+    read_only_mode: ReadOnlyMode | None = None,
+    savepoint: bool = False,
 ) -> Callable[Concatenate[Self, P], Awaitable[R]]:
+    if read_only_mode is not None and not read_only:
+        raise ValueError("read_only_mode requires read_only=True")
+
+    # everything depending on the signature of func is computed once here instead of on every call
+    pass_read_only = _accepts_read_only(func)
+    name = func.__qualname__
+    transaction_args: dict = {"isolation": None if read_only else "serializable"}
+    if read_only_mode == "snapshot":
+        transaction_args = {"isolation": "repeatable_read", "readonly": True}
+    elif read_only_mode == "serializable":
+        transaction_args = {"isolation": "serializable", "readonly": True, "deferrable": True}
+    # hot standby replicas do not support serializable transactions
+    use_replica = read_only and read_only_mode != "serializable"
+    # read only transactions in these modes cannot fail due to concurrent transactions on the primary, but on a hot
+    # standby replica snapshot transactions are cancelled with serialization failures on recovery conflicts
+    retry = read_only_mode is None or use_replica
+
+    async def call(self, scope: ConnectionScope, args, kwargs):
+        if read_only:
+            return await func(self, *args, **kwargs)
+        # memoized results might be changed by the write, including the ones memoized while it runs
+        scope.memo.clear()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            scope.memo.clear()
+
+    async def run_transaction(self, conn: Connection, args, kwargs):
+        kwargs["conn"] = conn
+        with connection_scope(conn, read_only=read_only) as scope:
+
+            async def attempt():
+                # results memoized by a failed attempt were read from the snapshot which caused the failure
+                scope.memo.clear()
+                async with conn.transaction(**transaction_args):
+                    return await call(self, scope, args, kwargs)
+
+            if not retry:
+                return await attempt()
+            policy = retry_policy or self.retry_policy
+            return await policy.run(name, attempt, max_attempts=n_retries)
+
+    async def run_nested(self, conn: Connection, args, kwargs):
+        with connection_scope(conn, read_only=read_only) as scope:
+            if not savepoint or not conn.is_in_transaction():
+                return await call(self, scope, args, kwargs)
+
+            # nested unit of work, on failure only the work since the savepoint is rolled back and retried
+            async def attempt_nested():
+                scope.memo.clear()
+                async with conn.transaction():
+                    return await call(self, scope, args, kwargs)
+
+            policy = retry_policy or self.retry_policy
+            return await policy.run(name, attempt_nested, max_attempts=n_retries, savepoint=True)
+
     @wraps(func)
     async def wrapper(self, *args: P.args, **kwargs: P.kwargs):
-        _add_readonly_to_kwargs(read_only, kwargs, func)
+        if pass_read_only:
+            kwargs[_READONLY_KWARG_NAME] = read_only
 
-        max_retries = n_retries or self.default_transaction_retries
-        current_retries = max_retries
         if "conn" in kwargs:
-            return await func(self, *args, **kwargs)
+            return await run_nested(self, typing.cast(Connection, kwargs["conn"]), args, kwargs)
+
+        # a connection already held by the calling service method in this task is reused
+        conn = current_connection(read_only=read_only)
+        if conn is not None:
+            if conn.is_in_transaction():
+                kwargs["conn"] = conn
+                return await run_nested(self, conn, args, kwargs)
+            return await run_transaction(self, conn, args, kwargs)
 
-        async with self.db_pool.acquire() as conn:
-            exception = None
-            while current_retries > 0:
-                try:
-                    async with conn.transaction(isolation=None if read_only else "serializable"):
-                        return await func(self, *args, conn=conn, **kwargs)
-                except (
-                    asyncpg.exceptions.DeadlockDetectedError,
-                    asyncpg.exceptions.SerializationError,
-                ) as e:
-                    current_retries -= 1
-                    # random quadratic back off, with a max of 1 second
-                    delay = min(random() * (max_retries - current_retries) ** 2 * 0.0001, 1.0)
-                    if delay == 1.0:
-                        logging.warning(
-                            "Max waiting time in quadratic back off of one second reached,"
-                            "check if there is any problem with your database transactions."
-                        )
-                    await asyncio.sleep(delay)
-
-                    exception = e
-
-            if exception:
-                raise exception
-            else:
-                raise RuntimeError("Unexpected error")
+        async with _acquire_connection(self, read_only=use_replica, budget=budget) as conn:
+            return await run_transaction(self, conn, args, kwargs)
 
     return wrapper
 
@@ -116,19 +217,83 @@ def with_db_transaction(
 
 @overload
 def with_db_transaction(
-    read_only: bool,
+    read_only: bool = False,
     n_retries: int | None = None,
+    *,
+    budget: ConnectionBudget | None = None,
+    retry_policy: RetryPolicy | None = None,
+    read_only_mode: ReadOnlyMode | None = None,
+    savepoint: bool = False,
 ) -> Callable[[Callable[Concatenate[Self, P], Awaitable[R]]], Callable[Concatenate[Self, P], Awaitable[R]]]:
     """Case with arguments"""
 
 
 @typing.no_type_check
-def with_db_transaction(read_only, n_retries: int | None = None):
+def with_db_transaction(
+    read_only=False,
+    n_retries: int | None = None,
+    *,
+    budget: ConnectionBudget | None = None,
+    retry_policy: RetryPolicy | None = None,
+    read_only_mode: ReadOnlyMode | None = None,
+    savepoint: bool = False,
+):
+    """
+    `budget` restricts the connections held by the decorated method, instead of the budget of its service.
+    `retry_policy` replaces the retry policy of the service, `n_retries` only its number of attempts.
+    `read_only_mode` opens read only methods as snapshot transactions which Postgres knows to be read only, see
+    ReadOnlyMode, by default they run in a read committed transaction.
+    With `savepoint` a call passing the connection of an enclosing transaction runs inside a savepoint, deadlocks and
+    lock timeouts only roll back and retry the work of the decorated method instead of the whole transaction.
+    """
     if callable(read_only):
         return _with_db_isolation_transaction(read_only, read_only=False, n_retries=n_retries)
     else:
 
         def wrapper(func):
-            return _with_db_isolation_transaction(func, read_only=read_only, n_retries=n_retries)
+            return _with_db_isolation_transaction(
+                func,
+                read_only=read_only,
+                n_retries=n_retries,
+                budget=budget,
+                retry_policy=retry_policy,
+                read_only_mode=read_only_mode,
+                savepoint=savepoint,
+            )
 
         return wrapper
+
+
+def memoized(func: Callable[Concatenate[Self, P], Awaitable[R]]) -> Callable[Concatenate[Self, P], Awaitable[R]]:
+    """
+    Memoize the results of a read only service method for the lifetime of the enclosing service call holding a
+    connection, keyed by the method and its arguments. Write methods running in the same scope clear all memoized
+    results when they start and when they return, as does every attempt of a retried transaction.
+    Calls outside of a connection scope or with unhashable arguments are not memoized.
+    The same result object is returned to all callers and must not be modified.
+
+        @memoized
+        @with_db_transaction(read_only=True)
+        async def get_permissions(self, *, conn: Connection, user_id: int) -> set[str]:
+            ...
+    """
+    name = func.__qualname__
+
+    @wraps(func)
+    async def wrapper(self, *args: P.args, **kwargs: P.kwargs):
+        scope = current_scope()
+        if scope is None:
+            return await func(self, *args, **kwargs)
+
+        try:
+            key = (name, self, args, frozenset((k, v) for k, v in kwargs.items() if k != "conn"))
+            if key in scope.memo:
+                return scope.memo[key]
+        except TypeError:
+            return await func(self, *args, **kwargs)
+
+        result = await func(self, *args, **kwargs)
+        scope.memo[key] = result
+        return result
+
+    return wrapper
@@ -0,0 +1,104 @@
+import asyncio
+
+from sftkit.cache import ResultCache, cached, invalidate_channel, notify_cache_invalidation, run_cache_invalidation
+from sftkit.database import Connection, Pool
+from sftkit.service import Service, with_db_transaction
+
+MAX_SIZE = 2
+TTL = 0.05
+
+
+def test_result_cache_lru():
+    cache = ResultCache("cache", max_size=MAX_SIZE)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+    # "b" has been used least recently
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert len(cache) == MAX_SIZE
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+async def test_result_cache_ttl():
+    cache = ResultCache("cache", ttl=TTL)
+    cache.put("a", 1)
+    assert cache.get("a") == (True, 1)
+    await asyncio.sleep(TTL * 2)
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 0
+
+
+class CatalogService(Service):
+    lookups = 0
+
+    @cached(invalidate_on="test_catalog")
+    @with_db_transaction(read_only=True)
+    async def product(self, product_id: int, *, conn: Connection) -> str:
+        self.lookups += 1
+        return await conn.fetchval("select 'product ' || $1::int", product_id)
+
+    @with_db_transaction
+    async def update(self, *, conn: Connection) -> str:
+        product = await self.product(1)  # type: ignore[call-arg]
+        await notify_cache_invalidation(conn, "test_catalog")
+        return product
+
+
+async def test_cached_service_method(test_db_pool: Pool):
+    service = CatalogService(db_pool=test_db_pool, config=None)
+    CatalogService.product.cache.clear()  # type: ignore[attr-defined]
+    assert await service.product(1) == "product 1"  # type: ignore[call-arg]
+    assert await service.product(1) == "product 1"  # type: ignore[call-arg]
+    assert await service.product(2) == "product 2"  # type: ignore[call-arg]
+    assert service.lookups == len([1, 2])
+
+    # calls within write transactions bypass the cache
+    await service.update()  # type: ignore[call-arg]
+    assert service.lookups == len([1, 2, 1])
+
+
+async def test_cache_invalidation_by_notification(test_db_pool: Pool):
+    service = CatalogService(db_pool=test_db_pool, config=None)
+    invalidation = asyncio.create_task(run_cache_invalidation(test_db_pool, channels=["test_catalog"]))
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    try:
+        await service.product(1)  # type: ignore[call-arg]
+        assert len(CatalogService.product.cache) == 1  # type: ignore[attr-defined]
+        await service.update()  # type: ignore[call-arg]
+        await asyncio.sleep(0.2)  # wait for the notification to arrive
+        assert len(CatalogService.product.cache) == 0  # type: ignore[attr-defined]
+    finally:
+        invalidation.cancel()
+        await asyncio.gather(invalidation, return_exceptions=True)
+
+
+class SlowService(Service):
+    def __init__(self, db_pool: Pool):
+        super().__init__(db_pool=db_pool, config=None)
+        self.started = asyncio.Event()
+        self.proceed = asyncio.Event()
+
+    @cached(invalidate_on="test_slow")
+    @with_db_transaction(read_only=True)
+    async def slow(self, *, conn: Connection) -> int:
+        result = await conn.fetchval("select 1")
+        self.started.set()
+        await self.proceed.wait()
+        return result
+
+
+async def test_invalidation_during_miss(test_db_pool: Pool):
+    service = SlowService(test_db_pool)
+    SlowService.slow.cache.clear()  # type: ignore[attr-defined]
+    call = asyncio.ensure_future(service.slow())  # type: ignore[call-arg]
+    await service.started.wait()
+    invalidate_channel("test_slow")
+    service.proceed.set()
+    assert await call == 1
+    # the result read before the invalidation is not cached
+    assert len(SlowService.slow.cache) == 0  # type: ignore[attr-defined]
+
+    assert await service.slow() == 1  # type: ignore[call-arg]
+    assert len(SlowService.slow.cache) == 1  # type: ignore[attr-defined]
@@ -0,0 +1,227 @@
+import pytest
+from pydantic import BaseModel, Field
+
+from sftkit.database import Connection, Database, DatabaseConfig, create_db_pool
+from sftkit.database._json import get_json_codec
+from sftkit.error import NotFound
+
+N_ROWS = 250
+
+
+class Row(BaseModel):
+    id: int
+    name: str
+
+
+async def test_fetch_iter(test_db_conn: Connection):
+    async with test_db_conn.fetch_iter(
+        Row, "select g as id, 'name' || g as name from generate_series(1, $1) as g order by g", N_ROWS, prefetch=100
+    ) as cursor:
+        rows = [row async for row in cursor]
+    assert len(rows) == N_ROWS
+    assert rows[0] == Row(id=1, name="name1")
+    assert rows[-1] == Row(id=N_ROWS, name=f"name{N_ROWS}")
+    assert not test_db_conn.is_in_transaction()
+
+
+async def test_fetch_iter_in_transaction(test_db_conn: Connection):
+    async with test_db_conn.transaction():
+        async with test_db_conn.fetch_iter(Row, "select 1 as id, 'foo' as name", prefetch=1) as cursor:
+            rows = [row async for row in cursor]
+        assert test_db_conn.is_in_transaction()
+    assert rows == [Row(id=1, name="foo")]
+
+
+async def test_fetch_iter_invalid_prefetch(test_db_conn: Connection):
+    with pytest.raises(ValueError):
+        async with test_db_conn.fetch_iter(Row, "select 1 as id, 'foo' as name", prefetch=0):
+            pass
+
+
+async def test_fetch_iter_stop_early(test_db_conn: Connection):
+    async with test_db_conn.fetch_iter(
+        Row, "select g as id, 'name' || g as name from generate_series(1, $1) as g", N_ROWS, prefetch=10
+    ) as cursor:
+        async for row in cursor:
+            assert row.id == 1
+            break
+    # the transaction of the cursor is closed right away
+    assert not test_db_conn.is_in_transaction()
+    assert await test_db_conn.fetchval("select 1") == 1
+
+
+async def test_fetch_iter_returning(test_db_conn: Connection):
+    async with test_db_conn.fetch_iter(
+        Row, "insert into \"user\" (name) values ('returned') returning id, name", prefetch=10
+    ) as cursor:
+        rows = [row async for row in cursor]
+    assert [r.name for r in rows] == ["returned"]
+    assert await test_db_conn.fetchval('select count(*) from "user"') == 1
+
+
+class RowWithDefaults(BaseModel):
+    id: int
+    display_name: str = Field(alias="name")
+    comment: str | None = None
+
+
+@pytest.mark.parametrize("trusted", [False, True])
+async def test_fetch_helpers(test_db_conn: Connection, trusted: bool):
+    query = "select g as id, 'name' || g as name, 'ignored' as extra from generate_series(1, $1) as g order by g"
+    rows = await test_db_conn.fetch_many(RowWithDefaults, query, 3, trusted=trusted)
+    assert [r.display_name for r in rows] == ["name1", "name2", "name3"]
+    assert rows[0].comment is None
+    assert rows[0].model_fields_set == {"id", "display_name"}
+
+    assert await test_db_conn.fetch_many(RowWithDefaults, query, 0, trusted=trusted) == []
+
+    row = await test_db_conn.fetch_one(RowWithDefaults, query, 1, trusted=trusted)
+    assert row == rows[0]
+
+    assert await test_db_conn.fetch_maybe_one(RowWithDefaults, query, 0, trusted=trusted) is None
+    with pytest.raises(NotFound):
+        await test_db_conn.fetch_one(RowWithDefaults, query, 0, trusted=trusted)
+
+
+class Name(BaseModel):
+    name: str
+
+
+@pytest.mark.parametrize(
+    "model, query",
+    [
+        (Row, "select g as id, 'name' || g as name from generate_series(1, 3) as g order by g"),
+        (Row, "select 'name' || g as name, g as id from generate_series(1, 3) as g order by g"),
+        (Name, "select g as id, 'name' || g as name from generate_series(1, 3) as g order by g"),
+    ],
+)
+async def test_trusted_rows_match_validated_rows(test_db_conn: Connection, model: type[BaseModel], query: str):
+    trusted = await test_db_conn.fetch_many(model, query, trusted=True)
+    validated = await test_db_conn.fetch_many(model, query)
+    assert trusted == validated
+    assert [r.model_dump() for r in trusted] == [r.model_dump() for r in validated]
+
+
+def test_json_codec_differences():
+    big_int = 2**70 + 1
+    assert DatabaseConfig(dbname="test", user="test").json_codec == "json"
+
+    stdlib = get_json_codec("json")
+    assert stdlib.loads(stdlib.dumps(big_int)) == big_int
+    assert stdlib.dumps(float("nan")) == b"NaN"
+
+    pytest.importorskip("orjson")
+    orjson = get_json_codec("orjson")
+    with pytest.raises(TypeError):
+        orjson.dumps(big_int)
+    assert isinstance(orjson.loads(str(big_int)), float)
+    assert orjson.dumps(float("nan")) == b"null"
+
+
+@pytest.mark.parametrize("json_codec", ["json", "orjson", "msgspec"])
+@pytest.mark.parametrize("json_binary_format", [False, True])
+async def test_json_codecs(test_db: Database, json_codec: str, json_binary_format: bool):
+    pytest.importorskip(json_codec)
+    cfg = test_db.config.model_copy(update={"json_codec": json_codec, "json_binary_format": json_binary_format})
+    pool = await create_db_pool(cfg, n_connections=1)
+    document = {"a": [1, 2.5, None, True], "b": {"nested": "value"}}
+    try:
+        async with pool.acquire() as conn:
+            assert await conn.fetchval("select $1::jsonb", document) == document
+            assert await conn.fetchval("select $1::json", document) == document
+            assert await conn.fetchval("""select '{"x": 1}'::jsonb""") == {"x": 1}
+            assert await conn.fetchval("select $1::jsonb ->> 'b'", document) == '{"nested": "value"}'
+    finally:
+        await pool.close()
+
+
+class NewUser(BaseModel):
+    name: str
+    is_registered: bool
+    comment: str | None = None
+
+
+class User(NewUser):
+    id: int
+
+
+async def test_insert_many(test_db_conn: Connection):
+    users = [NewUser(name=f"user{i}", is_registered=i % 2 == 0) for i in range(10)]
+    assert await test_db_conn.insert_many("user", users) == len(users)
+    assert await test_db_conn.insert_many("user", []) == 0
+
+    more_users = [NewUser(name=f"user{i}", is_registered=False, comment="async") for i in range(10, 15)]
+
+    async def stream_users():
+        for user in more_users:
+            yield user
+
+    assert await test_db_conn.insert_many("user", stream_users(), schema_name="public") == len(more_users)
+    db_users = await test_db_conn.fetch_many(User, 'select * from "user" order by id')
+    assert [u.name for u in db_users] == [f"user{i}" for i in range(15)]
+    assert db_users[-1].comment == "async"
+
+
+async def test_insert_many_on_conflict(test_db_conn: Connection):
+    await test_db_conn.insert_many("user", [NewUser(name="existing", is_registered=False)])
+
+    users = [NewUser(name="existing", is_registered=True, comment="updated"), NewUser(name="new", is_registered=True)]
+    assert await test_db_conn.insert_many("user", users, on_conflict="ignore") == 1
+    existing = await test_db_conn.fetch_one(User, "select * from \"user\" where name = 'existing'")
+    assert not existing.is_registered
+
+    n_upserted = await test_db_conn.upsert_many("user", users, conflict_columns=["name"], update_columns=["comment"])
+    assert n_upserted == len(users)
+    existing = await test_db_conn.fetch_one(User, "select * from \"user\" where name = 'existing'")
+    assert not existing.is_registered
+    assert existing.comment == "updated"
+
+    with pytest.raises(ValueError):
+        await test_db_conn.insert_many("user", users, on_conflict="update")
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+async def test_fetch_columns(test_db_conn: Connection, use_numpy: bool):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    columns = await test_db_conn.fetch_columns(
+        "select g as id, g * 0.5::float8 as value, g % 2 = 0 as even, 'name' || g as name, "
+        "  case when g = 3 then null else g end as maybe_null "
+        "from generate_series(1, $1) as g",
+        N_ROWS,
+        prefetch=100,
+        use_numpy=use_numpy,
+    )
+    assert list(columns) == ["id", "value", "even", "name", "maybe_null"]
+    assert list(columns["id"]) == list(range(1, N_ROWS + 1))
+    assert sum(columns["value"]) == sum(range(1, N_ROWS + 1)) * 0.5
+    assert list(columns["even"][:2]) == [False, True]
+    assert columns["name"][0] == "name1"
+    assert columns["maybe_null"][:4] == [1, 2, None, 4]
+    assert len(columns["maybe_null"]) == N_ROWS
+    if use_numpy:
+        assert columns["id"].dtype.name == "int32"
+        assert columns["even"].dtype == bool
+    else:
+        assert columns["id"].typecode == "i"
+
+
+@pytest.mark.parametrize("transaction_pooling", [True, False])
+async def test_transaction_pooling_statements(test_db: Database, transaction_pooling: bool):
+    cfg = test_db.config.model_copy(update={"transaction_pooling": transaction_pooling})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        async with pool.acquire() as conn:
+            await conn.insert_many("user", [NewUser(name="user", is_registered=False)])
+            await conn.insert_many("user", [NewUser(name="user", is_registered=False)], on_conflict="ignore")
+            async with conn.fetch_iter(User, 'select * from "user" where name = $1', "user") as users:
+                async for _ in users:
+                    break
+            await conn.fetch_columns('select * from "user"')
+            await conn.fetch('select * from "user" where id = $1', 1)
+            n_statements = await conn.fetchval("select count(*) from pg_prepared_statements")
+    finally:
+        await pool.close()
+
+    # behind a transaction pooler no named statement may outlive its transaction
+    assert (n_statements == 0) == transaction_pooling
@@ -1,6 +1,9 @@
 import asyncio
+import random
 
-from sftkit.database import DatabaseHook, Pool
+import pytest
+
+from sftkit.database import DatabaseHook, NotificationDispatcher, Pool
 
 
 async def test_hook(test_db_pool: Pool):
@@ -49,3 +52,249 @@ async def test_hook(test_db_pool: Pool):
 
     assert not initial_run
     assert received_payload == "lol"
+
+
+async def test_hooks_share_one_listening_connection(test_db_pool: Pool):
+    received: dict[str, list[str]] = {"channel_a": [], "channel_b": []}
+
+    def handler(channel: str):
+        async def handle(payload):
+            received[channel].append(payload)
+
+        return handle
+
+    idle = test_db_pool.get_idle_size()
+    hooks = [DatabaseHook(pool=test_db_pool, channel=channel, event_handler=handler(channel)) for channel in received]
+    tasks = [asyncio.create_task(hook.run()) for hook in hooks]
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    # the notifications are received over a connection outside of the pool
+    assert test_db_pool.get_idle_size() == idle
+    assert sorted(test_db_pool.notifications.channels) == sorted(received)
+    listeners = await test_db_pool.fetchval(
+        "select count(*) from pg_stat_activity where datname = current_database() and query like 'LISTEN%'"
+    )
+    assert listeners == 1
+
+    await test_db_pool.execute("select pg_notify('channel_a', 'a'), pg_notify('channel_b', 'b')")
+    await asyncio.sleep(0.2)  # wait for the notifications to arrive
+    for hook in hooks:
+        hook.stop()
+    await asyncio.gather(*tasks)
+
+    assert received == {"channel_a": ["a"], "channel_b": ["b"]}
+    # the listening connection is closed together with the last subscription
+    assert test_db_pool.notifications.channels == []
+
+
+async def test_dispatcher_reconnects(test_db_pool: Pool):
+    dispatcher = NotificationDispatcher(test_db_pool.acquire_direct, reconnect_delay=0.1)
+    received: list[str] = []
+    connects = 0
+
+    def on_connect():
+        nonlocal connects
+        connects += 1
+
+    async with dispatcher.subscription("testchannel", lambda c, p, ch, payload: received.append(payload), on_connect):
+        assert connects == 1
+        await test_db_pool.execute(
+            "select pg_terminate_backend(pid) from pg_stat_activity "
+            "where datname = current_database() and query = 'LISTEN \"testchannel\"'"
+        )
+        await asyncio.sleep(0.5)  # wait for the connection to be reestablished
+        assert connects == len([1, 2])
+        await test_db_pool.execute("select pg_notify('testchannel', 'after reconnect')")
+        await asyncio.sleep(0.2)  # wait for the notification to arrive
+
+    assert received == ["after reconnect"]
+
+
+async def test_hook_debounce(test_db_pool: Pool):
+    received: list[str] = []
+
+    async def handler(payload):
+        received.append(payload)
+
+    hook = DatabaseHook(pool=test_db_pool, channel="testchannel", event_handler=handler, debounce=0.1)
+    task = asyncio.create_task(hook.run())
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    # postgres only collapses identical notifications within a transaction
+    for i in range(20):
+        await test_db_pool.execute("select pg_notify('testchannel', $1)", f"product {i % 2}")
+    await asyncio.sleep(0.3)  # wait for the notifications to arrive
+    hook.stop()
+    await task
+
+    assert received == ["product 0", "product 1"]
+
+
+async def test_hook_batches(test_db_pool: Pool):
+    batch_size = 10
+    batches: list[list[str]] = []
+
+    async def handler(payloads):
+        batches.append(payloads)
+
+    hook = DatabaseHook(
+        pool=test_db_pool, channel="testchannel", event_handler=handler, batch_size=batch_size, batch_timeout=0.1
+    )
+    task = asyncio.create_task(hook.run())
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    n_payloads = 25
+    await test_db_pool.execute(
+        "select pg_notify('testchannel', g::text) from generate_series(1, $1::int) g order by g", n_payloads
+    )
+    await asyncio.sleep(0.3)  # wait for the notifications to arrive
+    hook.stop()
+    await task
+
+    assert [len(batch) for batch in batches] == [batch_size, batch_size, n_payloads - 2 * batch_size]
+    assert [payload for batch in batches for payload in batch] == [str(i) for i in range(1, n_payloads + 1)]
+
+
+class BlockedHandler:
+    """records the payloads once unblocked, catch up runs are counted right away"""
+
+    def __init__(self):
+        self.unblocked = asyncio.Event()
+        self.received: list[str] = []
+        self.catch_ups = 0
+
+    async def __call__(self, payload):
+        if payload is None:
+            self.catch_ups += 1
+            return
+        await self.unblocked.wait()
+        self.received.append(payload)
+
+
+async def notify_all(pool: Pool, n_payloads: int):
+    await pool.execute(
+        "select pg_notify('testchannel', g::text) from generate_series(1, $1::int) g order by g", n_payloads
+    )
+
+
+async def run_blocked_hook(pool: Pool, n_payloads: int, **hook_args) -> tuple[DatabaseHook, BlockedHandler]:
+    handler = BlockedHandler()
+    hook = DatabaseHook(pool=pool, channel="testchannel", event_handler=handler.__call__, queue_size=2, **hook_args)
+    task = asyncio.create_task(hook.run())
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    await notify_all(pool, n_payloads)
+    await asyncio.sleep(0.2)  # wait for the notifications to arrive
+    handler.unblocked.set()
+    await asyncio.sleep(0.2)  # wait for the handler to catch up
+    hook.stop()
+    await task
+    return hook, handler
+
+
+async def test_hook_overflow_spill(test_db_pool: Pool):
+    n_payloads = 10
+    hook, handler = await run_blocked_hook(test_db_pool, n_payloads, overflow="spill")
+    assert handler.received == [str(i) for i in range(1, n_payloads + 1)]
+    stats = hook.stats()
+    # at most one payload is handled and two are queued while the handler is blocked
+    assert stats.max_spilled >= n_payloads - len([1, 2, 3])
+    assert stats.dropped == 0
+    assert stats.resyncs == 0
+
+
+async def test_hook_overflow_drop_oldest(test_db_pool: Pool):
+    n_payloads = 10
+    hook, handler = await run_blocked_hook(test_db_pool, n_payloads, overflow="drop_oldest", initial_run=True)
+    assert handler.received[-2:] == ["9", "10"]
+    # the initial run and the resync after dropping payloads
+    assert handler.catch_ups == len(["initial", "resync"])
+    stats = hook.stats()
+    assert stats.dropped == n_payloads - len(handler.received)
+    assert stats.resyncs == 1
+
+
+async def test_hook_overflow_resync(test_db_pool: Pool):
+    n_payloads = 10
+    hook, handler = await run_blocked_hook(test_db_pool, n_payloads, overflow="resync", initial_run=True)
+    assert len(handler.received) < n_payloads
+    assert handler.catch_ups == len(["initial", "resync"])
+    stats = hook.stats()
+    assert stats.dropped == n_payloads - len(handler.received)
+    assert stats.resyncs == 1
+
+
+async def test_hook_resync_after_reconnect(test_db_pool: Pool):
+    dispatcher = NotificationDispatcher(test_db_pool.acquire_direct, reconnect_delay=0.1)
+    handler = BlockedHandler()
+    handler.unblocked.set()
+    hook = DatabaseHook(
+        pool=test_db_pool,
+        channel="testchannel",
+        event_handler=handler.__call__,
+        initial_run=True,
+        dispatcher=dispatcher,
+    )
+    task = asyncio.create_task(hook.run())
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    assert handler.catch_ups == 1
+    await test_db_pool.execute(
+        "select pg_terminate_backend(pid) from pg_stat_activity "
+        "where datname = current_database() and query = 'LISTEN \"testchannel\"'"
+    )
+    await asyncio.sleep(0.5)  # wait for the connection to be reestablished
+    hook.stop()
+    await task
+    assert handler.catch_ups == len(["initial", "resync"])
+    assert hook.stats().resyncs == 1
+
+
+async def test_hook_partitioned_order(test_db_pool: Pool):
+    num_parallel = 2
+    n_payloads = 30
+    received: dict[str, list[int]] = {}
+    running: set[str] = set()
+    max_running = 0
+
+    async def handler(payload: str | None):
+        nonlocal max_running
+        assert payload is not None
+        key, index = payload.split(":")
+        assert key not in running
+        running.add(key)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(random.uniform(0, 0.01))
+        received.setdefault(key, []).append(int(index))
+        running.remove(key)
+
+    hook = DatabaseHook(
+        pool=test_db_pool,
+        channel="testchannel",
+        event_handler=handler,
+        partition_key=lambda payload: payload.split(":")[0],
+    )
+    task = asyncio.create_task(hook.run(num_parallel=num_parallel))
+    await asyncio.sleep(0.5)  # wait for the listener to be set up
+    await test_db_pool.execute(
+        "select pg_notify('testchannel', chr(97 + g % 3) || ':' || g) from generate_series(1, $1::int) g order by g",
+        n_payloads,
+    )
+    await asyncio.sleep(0.5)  # wait for the notifications to be handled
+    hook.stop()
+    await task
+
+    assert sorted(received) == ["a", "b", "c"]
+    for indices in received.values():
+        assert indices == sorted(indices)
+    assert sum(len(indices) for indices in received.values()) == n_payloads
+    assert max_running == num_parallel
+
+
+async def test_dispatcher_closed(test_db_pool: Pool):
+    dispatcher = NotificationDispatcher(test_db_pool.acquire_direct)
+    subscription = await dispatcher.subscribe("testchannel", lambda c, p, ch, payload: None)
+
+    # a subscription racing with close is rejected instead of silently not being listened to
+    results = await asyncio.gather(
+        dispatcher.close(), dispatcher.subscribe("otherchannel", lambda c, p, ch, payload: None), return_exceptions=True
+    )
+    assert isinstance(results[1], RuntimeError)
+    with pytest.raises(RuntimeError):
+        await dispatcher.subscribe("testchannel", lambda c, p, ch, payload: None)
+    await dispatcher.unsubscribe(subscription)
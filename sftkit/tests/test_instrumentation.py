@@ -0,0 +1,154 @@
+import logging
+
+import pytest
+
+from sftkit.database import Database, QueryStatistics, create_db_pool
+from sftkit.database._instrumentation import LATENCY_BUCKETS, normalize_query
+
+N_CALLS = 5
+SLOW_QUERY_THRESHOLD = 0.05
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("select  *\n from t where id = 1", "select * from t where id = ?"),
+        ("select * from t where name = 'it''s' and x = -1.5", "select * from t where name = ? and x = ?"),
+        ("select * from t where id in (1, 2, 3)", "select * from t where id in (?)"),
+        ("select * from t2 where id = $1", "select * from t2 where id = $1"),
+    ],
+)
+def test_normalize_query(query: str, expected: str):
+    assert normalize_query(query) == expected
+
+
+def test_query_statistics_record():
+    stats = QueryStatistics()
+    stats.record("select 1", (), elapsed=0.002, rows=1)
+    stats.record("select  2", (), elapsed=0.004, rows=1)
+    stats.record("select 3", (), elapsed=0.1, rows=0, failed=True)
+
+    snapshot = stats.snapshot()
+    assert len(snapshot) == 1
+    entry = snapshot[0]
+    assert entry.query == "select ?"
+    assert entry.calls == len(["select 1", "select 2", "select 3"])
+    assert entry.errors == 1
+    assert entry.rows == len(["select 1", "select 2"])
+    assert entry.min_time == pytest.approx(0.002)
+    assert entry.max_time == pytest.approx(0.1)
+    assert entry.mean_time == pytest.approx(0.106 / entry.calls)
+    assert len(entry.histogram) == len(LATENCY_BUCKETS)
+    assert sum(entry.histogram) == entry.calls
+
+    assert len(stats.snapshot(reset=True)) == 1
+    assert stats.snapshot() == []
+
+
+async def test_pool_query_statistics(test_db: Database):
+    cfg = test_db.config.model_copy(update={"collect_query_statistics": True})
+    pool = await create_db_pool(cfg, n_connections=2)
+    try:
+        pool.query_statistics.reset()
+        for i in range(N_CALLS):
+            await pool.execute('insert into "user" (name) values ($1)', f"user{i}")
+        users = await pool.fetch('select * from "user"')
+        with pytest.raises(Exception):
+            await pool.fetchval("select * from does_not_exist")
+
+        stats = {s.query: s for s in pool.query_statistics.snapshot()}
+        # the statements asyncpg issues when releasing connections are not recorded
+        assert set(stats.keys()) == {
+            'insert into "user" (name) values ($1)',
+            'select * from "user"',
+            "select * from does_not_exist",
+        }
+        insert = stats['insert into "user" (name) values ($1)']
+        assert insert.calls == N_CALLS
+        assert insert.rows == N_CALLS
+        select = stats['select * from "user"']
+        assert select.calls == 1
+        assert select.rows == len(users)
+        assert stats["select * from does_not_exist"].errors == 1
+    finally:
+        await pool.close()
+
+
+async def test_query_statistics_disabled_by_default(test_db_pool):
+    await test_db_pool.execute("select 1")
+    assert test_db_pool.query_statistics.snapshot() == []
+
+
+async def test_slow_query_log(test_db: Database, caplog: pytest.LogCaptureFixture):
+    cfg = test_db.config.model_copy(update={"slow_query_threshold": 0.05})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        with caplog.at_level(logging.WARNING, logger="sftkit.database._instrumentation"):
+            await pool.execute("select pg_sleep(0.1), $1::text", "argument")
+            await pool.execute("select 1")
+    finally:
+        await pool.close()
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert len(messages) == 1
+    assert "select pg_sleep(?), $1::text" in messages[0]
+    assert "str(len=8)" in messages[0]
+    assert "test_instrumentation.py" in messages[0]
+    # only slow queries are logged, statistics are not collected
+    assert pool.query_statistics.snapshot() == []
+
+
+async def test_capture_query_plans(test_db: Database):
+    cfg = test_db.config.model_copy(update={"explain_sample_rate": 1.0, "explain_max_plans": 2})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute('insert into "user" (name) values ($1)', "user")
+            async with conn.transaction():
+                await conn.fetch('select * from "user" where name = $1', "user")
+                # statements which cannot be explained are skipped
+                await conn.execute("set local statement_timeout = 1000")
+            n_users = await conn.fetchval('select count(*) from "user"')
+    finally:
+        await pool.close()
+
+    # the insert has been explained with analyze but the second execution was rolled back
+    assert n_users == 1
+    plans = pool.query_plans.snapshot()
+    assert len(plans) == cfg.explain_max_plans
+    assert plans[0].query == 'select count(*) from "user"'
+    assert plans[1].query == 'select * from "user" where name = $1'
+    assert plans[1].args == ["str(len=4)"]
+    assert "Node Type" in plans[1].plan[0]["Plan"]
+    assert "Shared Hit Blocks" in plans[1].plan[0]["Plan"]
+
+
+async def test_capture_query_plans_statistics(test_db: Database):
+    cfg = test_db.config.model_copy(update={"explain_sample_rate": 1.0, "collect_query_statistics": True})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        for _ in range(N_CALLS):
+            await pool.fetchval("select 1")
+        stats = pool.query_statistics.snapshot()
+        plans = pool.query_plans.snapshot()
+    finally:
+        await pool.close()
+
+    # neither the savepoints of the captured plans nor the statements asyncpg issues on release are instrumented
+    assert [(s.query, s.calls) for s in stats] == [("select ?", N_CALLS)]
+    assert [p.query for p in plans] == ["select 1"] * N_CALLS
+
+
+async def test_capture_slow_query_plans(test_db: Database):
+    cfg = test_db.config.model_copy(update={"explain_threshold": SLOW_QUERY_THRESHOLD})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        await pool.execute("select pg_sleep(0.1)")
+        await pool.execute("select 1")
+        plans = pool.query_plans.snapshot()
+        assert [p.query for p in plans] == ["select pg_sleep(0.1)"]
+        assert plans[0].duration >= SLOW_QUERY_THRESHOLD
+        pool.query_plans.clear()
+        assert pool.query_plans.snapshot() == []
+    finally:
+        await pool.close()
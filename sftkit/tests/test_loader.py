@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from sftkit.database import Connection
+from sftkit.error import NotFound
+
+USER_QUERY = 'select * from "user" where id = any($1)'
+
+
+class User(BaseModel):
+    id: int
+    name: str
+
+
+@pytest.fixture
+async def user_ids(test_db_conn: Connection) -> list[int]:
+    return [
+        await test_db_conn.fetchval('insert into "user" (name) values ($1) returning id', f"user{i}") for i in range(5)
+    ]
+
+
+async def test_batch_loader(test_db_conn: Connection, user_ids: list[int]):
+    queries = []
+    test_db_conn.add_query_logger(lambda record: queries.append(record.query) if record.query == USER_QUERY else None)
+
+    loader = test_db_conn.batch_loader(User, USER_QUERY)
+    users = await asyncio.gather(*(loader.load(user_id) for user_id in user_ids))
+    assert [u.id for u in users] == user_ids
+    assert [u.name for u in users] == [f"user{i}" for i in range(len(user_ids))]
+
+    # cached results do not issue any new query
+    assert await loader.load(user_ids[0]) == users[0]
+    await asyncio.sleep(0)
+    assert len(queries) == 1
+
+    results = await asyncio.gather(loader.load(user_ids[1]), loader.load(-1), return_exceptions=True)
+    assert results[0] == users[1]
+    assert isinstance(results[1], NotFound)
+    assert results[1].element_id == -1
+
+
+async def test_batch_loader_max_batch_size(test_db_conn: Connection, user_ids: list[int]):
+    queries = []
+    test_db_conn.add_query_logger(lambda record: queries.append(record.query) if record.query == USER_QUERY else None)
+
+    loader = test_db_conn.batch_loader(User, USER_QUERY, max_batch_size=2)
+    users = await loader.load_many(user_ids)
+    assert [u.id for u in users] == user_ids
+    await asyncio.sleep(0)
+    assert len(queries) == (len(user_ids) + 1) // 2
+
+
+async def test_batch_loader_cancelled_caller(test_db_conn: Connection, user_ids: list[int]):
+    loader = test_db_conn.batch_loader(User, 'select u.* from "user" u, pg_sleep(0.2) where u.id = any($1)')
+
+    async def load():
+        return await loader.load(user_ids[0])
+
+    cancelled = asyncio.create_task(load())
+    waiting = asyncio.create_task(load())
+    await asyncio.sleep(0.05)
+    cancelled.cancel()
+
+    # other callers of the same key are not affected
+    user = await waiting
+    assert user.id == user_ids[0]
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert await loader.load(user_ids[0]) == user
+
+
+async def test_batch_loader_does_not_cache_failures(test_db_conn: Connection):
+    loader = test_db_conn.batch_loader(User, USER_QUERY)
+    with pytest.raises(NotFound):
+        await loader.load(-1)
+    user_id = await test_db_conn.fetchval(
+        'insert into "user" (id, name) overriding system value values (-1, $1) returning id', "late"
+    )
+    assert (await loader.load(user_id)).name == "late"
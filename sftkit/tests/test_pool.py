@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+from fastapi.routing import APIRoute
+
+from sftkit.database import Database, Pool, _pool, create_db_pool
+from sftkit.http import HTTPServerConfig, Server
+
+MAX_CONNECTIONS = 4
+IDLE_TIME = 0.1
+
+
+async def test_elastic_pool_size(test_db: Database):
+    cfg = test_db.config.model_copy(update={"min_connections": 1, "max_idle_time": IDLE_TIME})
+    pool = await create_db_pool(cfg, n_connections=MAX_CONNECTIONS)
+    try:
+        assert pool.get_min_size() == 1
+        assert pool.get_max_size() == MAX_CONNECTIONS
+        assert pool.get_size() == 1
+
+        async def hold():
+            async with pool.acquire() as conn:
+                await conn.execute("select pg_sleep(0.05)")
+
+        await asyncio.gather(*(hold() for _ in range(MAX_CONNECTIONS)))
+        assert pool.get_size() == MAX_CONNECTIONS
+
+        # idle connections are closed down to the minimum pool size
+        await asyncio.sleep(IDLE_TIME * 5)
+        assert pool.get_size() == 1
+    finally:
+        await pool.close()
+
+
+async def test_min_connections_default_to_pool_size(test_db: Database):
+    pool = await test_db.create_pool(n_connections=2)
+    try:
+        assert pool.get_min_size() == pool.get_max_size() == pool.get_size()
+    finally:
+        await pool.close()
+
+
+async def test_max_connection_lifetime(test_db: Database):
+    cfg = test_db.config.model_copy(update={"max_connection_lifetime": IDLE_TIME})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        async with pool.acquire() as conn:
+            pid = conn.get_server_pid()
+        async with pool.acquire() as conn:
+            assert conn.get_server_pid() == pid
+            await asyncio.sleep(IDLE_TIME * 2)
+
+        # the connection exceeded its lifetime when it was released and has been replaced
+        async with pool.acquire() as conn:
+            assert conn.get_server_pid() != pid
+    finally:
+        await pool.close()
+
+
+async def test_pool_metrics(test_db: Database):
+    cfg = test_db.config.model_copy(update={"collect_pool_metrics": True})
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        async with pool.acquire() as conn:
+            stats = pool.stats()
+            assert stats.in_use == 1
+            assert stats.idle == 0
+
+            # a second acquisition has to wait for the first connection to be released
+            async def wait_for_connection():
+                return await pool.fetchval("select 1")
+
+            waiting = asyncio.create_task(wait_for_connection())
+            await asyncio.sleep(IDLE_TIME)
+            await conn.execute("select 1")
+
+        assert await waiting == 1
+        with pytest.raises(asyncio.TimeoutError):
+            async with pool.acquire():
+                await pool.acquire(timeout=IDLE_TIME)
+
+        stats = pool.stats(reset=True)
+        assert stats.size == stats.idle == 1
+        assert stats.acquisitions == len(["acquire", "fetchval", "acquire"])
+        assert stats.exhausted == 1
+        assert stats.timeouts == 1
+        assert stats.max_wait_time >= IDLE_TIME
+        assert sum(stats.wait_histogram) == stats.acquisitions
+        call_sites = {s.call_site.split(" in ")[-1] for s in stats.hold_times}
+        assert call_sites == {"test_pool_metrics", "test_pool_metrics.<locals>.wait_for_connection"}
+        assert sum(s.acquisitions for s in stats.hold_times) == stats.acquisitions
+        assert max(s.max_hold_time for s in stats.hold_times) >= IDLE_TIME
+
+        assert pool.stats().acquisitions == 0
+    finally:
+        await pool.close()
+
+
+async def test_pool_metrics_route(test_db_pool: Pool):
+    server: Server = Server(
+        title="test",
+        config=HTTPServerConfig(base_url="http://localhost", host="localhost", port=8080),
+        version="1",
+        license_name="MIT",
+    )
+    server.add_pool_metrics_route(test_db_pool)
+    route = next(r for r in server.api.routes if isinstance(r, APIRoute) and r.path == "/metrics/db-pool")
+    stats = await route.endpoint()
+    assert stats.max_size == test_db_pool.get_max_size()
+    # metrics are not collected by default
+    assert stats.acquisitions == 0
+
+
+@pytest.mark.parametrize("warm_type_cache", [True, False])
+async def test_type_cache(test_db: Database, test_db_pool: Pool, warm_type_cache: bool):
+    await test_db_pool.execute("create type mood as enum ('happy', 'sad')")
+    await test_db_pool.execute("create type point3 as (x float8, y float8, z float8)")
+
+    cfg = test_db.config.model_copy(update={"warm_type_cache": warm_type_cache})
+    pool = await create_db_pool(cfg, n_connections=2)
+    try:
+        async with pool.acquire() as conn:
+            introspections = []
+            conn.add_query_logger(
+                lambda record: introspections.append(record.query) if "typeinfo_tree" in record.query else None
+            )
+            assert await conn.fetchval("select $1::int8[]", [1, 2]) == [1, 2]
+            assert await conn.fetchval("select array['happy', 'sad']::mood[]") == ["happy", "sad"]
+            point = await conn.fetchval("select row(1, 2, 3)::point3")
+            assert tuple(point) == (1, 2, 3)
+            assert (len(introspections) == 0) == warm_type_cache
+    finally:
+        await pool.close()
+
+
+async def test_type_cache_cleared_after_migrations(test_db: Database):
+    pool = await test_db.create_pool(n_connections=1)
+    try:
+        assert pool.type_cache is not None
+        async with pool.acquire():
+            pass
+        await test_db.apply_migrations()
+        assert pool.type_cache._types is None  # pylint: disable=protected-access
+        assert await pool.fetchval("select $1::int8[]", [1]) == [1]
+    finally:
+        await pool.close()
+
+
+async def test_transaction_pooling_direct_connection(test_db: Database):
+    cfg = test_db.config.model_copy(update={"transaction_pooling": True, "direct_host": test_db.config.host})
+    assert cfg.direct().host == test_db.config.host
+    assert not cfg.direct().transaction_pooling
+    pool = await create_db_pool(cfg, n_connections=1)
+    try:
+        async with pool.acquire_direct() as conn:
+            # the direct connection is not taken from the pool
+            assert pool.get_idle_size() == 1
+            assert await conn.fetchval("show jit") == "off"
+    finally:
+        await pool.close()
+
+
+async def test_migrations_do_not_connect_to_replicas(test_db: Database, monkeypatch: pytest.MonkeyPatch):
+    test_db.config = test_db.config.model_copy(update={"replica_hosts": [test_db.config.host]})
+    assert test_db.config.direct().replica_hosts == []
+
+    async def create_replica_set(*args, **kwargs):
+        raise AssertionError("migrations must not create replica pools")
+
+    monkeypatch.setattr(_pool, "_create_replica_set", create_replica_set)
+    await test_db.apply_migrations()
+    await test_db.reload_code()
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from sftkit.database import Connection, Database, Pool, _replicas, create_db_pool
+from sftkit.database._replicas import parse_replica_host
+from sftkit.service import Service, with_db_transaction
+
+LAG_CHECK_INTERVAL = 60.0
+MAX_LAG = 5.0
+
+
+@pytest.mark.parametrize(
+    "replica, expected",
+    [
+        ("replica", ("replica", 5432)),
+        ("replica:5433", ("replica", 5433)),
+        ("::1", ("::1", 5432)),
+        ("[::1]", ("::1", 5432)),
+        ("[::1]:5433", ("::1", 5433)),
+    ],
+)
+def test_parse_replica_host(replica: str, expected: tuple[str, int]):
+    assert parse_replica_host(replica, default_port=5432) == expected
+
+
+@pytest.fixture
+async def replicated_pool(test_db: Database):
+    # the test database server doubles as both replicas
+    cfg = test_db.config.model_copy(
+        update={
+            "replica_hosts": [test_db.config.host, f"{test_db.config.host}:{test_db.config.port}"],
+            "max_replica_lag": MAX_LAG,
+            "replica_lag_check_interval": LAG_CHECK_INTERVAL,
+        }
+    )
+    pool = await create_db_pool(cfg, n_connections=2)
+    yield pool
+    await pool.close()
+
+
+async def test_least_outstanding_replica(replicated_pool: Pool):
+    replicas = replicated_pool.replicas
+    assert replicas is not None
+    assert [r.lag for r in replicas.replicas] == [0, 0]
+
+    async with replicated_pool.acquire_read_only() as conn1:
+        assert [r.outstanding for r in replicas.replicas] == [1, 0]
+        async with replicated_pool.acquire_read_only() as conn2:
+            assert [r.outstanding for r in replicas.replicas] == [1, 1]
+            assert await conn1.fetchval("select 1") == await conn2.fetchval("select 1")
+    assert [r.outstanding for r in replicas.replicas] == [0, 0]
+
+    # without outstanding acquisitions the replicas are used in turn
+    for _ in range(4):
+        async with replicated_pool.acquire_read_only():
+            pass
+    assert replicas.replicas[0].acquisitions == replicas.replicas[1].acquisitions
+
+
+async def test_lagging_replicas_fall_back_to_primary(replicated_pool: Pool):
+    replicas = replicated_pool.replicas
+    assert replicas is not None
+    replicas.replicas[0].lag = MAX_LAG * 2
+    replicas.replicas[1].lag = None
+
+    async with replicated_pool.acquire_read_only():
+        assert [r.outstanding for r in replicas.replicas] == [0, 0]
+        assert replicated_pool.get_idle_size() == replicated_pool.get_size() - 1
+
+    await replicas.check_lag()
+    async with replicated_pool.acquire_read_only():
+        assert sum(r.outstanding for r in replicas.replicas) == 1
+
+
+class ReplicaService(Service):
+    @with_db_transaction(read_only=True)
+    async def read(self, *, conn: Connection) -> bool:
+        del conn
+        assert self.db_pool.replicas is not None
+        return sum(r.outstanding for r in self.db_pool.replicas.replicas) == 1
+
+    @with_db_transaction
+    async def write(self, *, conn: Connection) -> bool:
+        del conn
+        assert self.db_pool.replicas is not None
+        return sum(r.outstanding for r in self.db_pool.replicas.replicas) == 1
+
+
+async def test_read_only_service_methods_use_replicas(replicated_pool: Pool):
+    service = ReplicaService(db_pool=replicated_pool, config=None)
+    assert await service.read()  # type: ignore[call-arg]
+    assert not await service.write()  # type: ignore[call-arg]
+
+
+async def test_lag_check_with_busy_replica_pool(replicated_pool: Pool):
+    replicas = replicated_pool.replicas
+    assert replicas is not None
+    # exhaust the pools of both replicas
+    held = [(r, await r.pool.acquire()) for r in replicas.replicas for _ in range(r.pool.get_max_size())]
+    try:
+        await replicas.check_lag()
+        assert [r.lag for r in replicas.replicas] == [0, 0]
+    finally:
+        for replica, conn in held:
+            await replica.pool.release(conn)
+
+
+async def test_aborted_acquire_releases_outstanding(replicated_pool: Pool):
+    replicas = replicated_pool.replicas
+    assert replicas is not None
+    held = [(r, await r.pool.acquire()) for r in replicas.replicas for _ in range(r.pool.get_max_size())]
+    try:
+        for _ in replicas.replicas:
+            with pytest.raises(TimeoutError):
+                async with replicated_pool.acquire_read_only(timeout=0.05):
+                    pass
+        assert [r.outstanding for r in replicas.replicas] == [0, 0]
+        assert [r.lag for r in replicas.replicas] == [0, 0]
+
+        task = asyncio.create_task(replicated_pool.acquire_read_only().__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert [r.outstanding for r in replicas.replicas] == [0, 0]
+    finally:
+        for replica, conn in held:
+            await replica.pool.release(conn)
+
+
+async def test_replica_without_wal_receiver_is_not_used(replicated_pool: Pool, monkeypatch: pytest.MonkeyPatch):
+    replicas = replicated_pool.replicas
+    assert replicas is not None
+    # the lag query yields NULL for standbys whose WAL receiver is not streaming
+    monkeypatch.setattr(_replicas, "REPLICATION_LAG_QUERY", "select null::float8")
+    await replicas.check_lag()
+    assert [r.lag for r in replicas.replicas] == [None, None]
+    assert replicas.choose() is None
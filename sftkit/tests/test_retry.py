@@ -0,0 +1,148 @@
+import asyncpg
+import pytest
+
+from sftkit.database import Connection, Pool
+from sftkit.retry import RetryBudget, RetryPolicy, RetryStatistics
+from sftkit.service import Service, with_db_transaction
+
+MAX_ATTEMPTS = 3
+BASE_DELAY = 0.001
+MAX_DELAY = 0.01
+
+
+def _failing(n_failures: int, error: type[Exception] = asyncpg.exceptions.SerializationError):
+    calls: list[None] = []
+
+    async def func():
+        calls.append(None)
+        if len(calls) <= n_failures:
+            raise error("conflict")
+        return len(calls)
+
+    return func, calls
+
+
+def _policy(**kwargs) -> RetryPolicy:
+    kwargs.setdefault("budget", RetryBudget())
+    return RetryPolicy(
+        max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY, statistics=RetryStatistics(), **kwargs
+    )
+
+
+async def test_retry_until_success():
+    policy = _policy()
+    func, calls = _failing(n_failures=MAX_ATTEMPTS - 1)
+    assert await policy.run("func", func) == MAX_ATTEMPTS
+    [stats] = policy.statistics.snapshot()
+    assert stats.name == "func"
+    assert stats.sqlstate == asyncpg.exceptions.SerializationError.sqlstate
+    assert stats.retries == len(calls) - 1
+    assert stats.exhausted == 0
+
+
+async def test_retry_exhausted():
+    policy = _policy()
+    func, calls = _failing(n_failures=MAX_ATTEMPTS, error=asyncpg.exceptions.DeadlockDetectedError)
+    with pytest.raises(asyncpg.exceptions.DeadlockDetectedError):
+        await policy.run("func", func)
+    assert len(calls) == MAX_ATTEMPTS
+    [stats] = policy.statistics.snapshot(reset=True)
+    assert stats.sqlstate == asyncpg.exceptions.DeadlockDetectedError.sqlstate
+    assert (stats.retries, stats.exhausted) == (MAX_ATTEMPTS - 1, 1)
+    assert policy.statistics.snapshot() == []
+
+    # other errors are not retried
+    func, calls = _failing(n_failures=1, error=ValueError)
+    with pytest.raises(ValueError):
+        await policy.run("func", func)
+    assert len(calls) == 1
+
+
+async def test_retry_budget():
+    policy = _policy(budget=RetryBudget(ratio=0, min_per_second=0, max_tokens=1))
+    func, calls = _failing(n_failures=1)
+    await policy.run("func", func)
+    assert len(calls) == len(["failure", "retry"])
+
+    # the budget has been used up, retrying stops
+    func, calls = _failing(n_failures=1)
+    with pytest.raises(asyncpg.exceptions.SerializationError):
+        await policy.run("func", func)
+    assert len(calls) == 1
+
+
+async def test_retry_time_budget():
+    policy = _policy(time_budget=0)
+    func, calls = _failing(n_failures=1)
+    with pytest.raises(asyncpg.exceptions.SerializationError):
+        await policy.run("func", func)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("backoff", ["exponential", "decorrelated"])
+def test_retry_delays(backoff):
+    policy = _policy(backoff=backoff)
+    delay = 0.0
+    for attempt in range(1, 20):
+        delay = policy.next_delay(attempt, delay)
+        assert 0 <= delay <= MAX_DELAY
+
+
+class RetryService(Service):
+    def __init__(self, db_pool: Pool):
+        super().__init__(db_pool=db_pool, config=None, retry_policy=_policy())
+        self.calls = 0
+
+    @with_db_transaction
+    async def conflicting(self, *, conn: Connection) -> int:
+        self.calls += 1
+        if self.calls == 1:
+            raise asyncpg.exceptions.SerializationError("conflict")
+        return await conn.fetchval("select 1")
+
+
+async def test_service_retries(test_db_pool: Pool):
+    service = RetryService(test_db_pool)
+    assert await service.conflicting() == 1  # type: ignore[call-arg]
+    [stats] = service.retry_policy.statistics.snapshot()
+    assert stats.name == "RetryService.conflicting"
+    assert stats.retries == 1
+
+
+class NestedService(Service):
+    def __init__(self, db_pool: Pool, inner_error: type[Exception]):
+        super().__init__(db_pool=db_pool, config=None, retry_policy=_policy())
+        self.inner_error = inner_error
+        self.outer_calls = 0
+        self.inner_calls = 0
+
+    @with_db_transaction
+    async def outer(self, *, conn: Connection) -> int:
+        self.outer_calls += 1
+        await conn.execute("create temporary table item (id int) on commit drop")
+        await self.inner(conn=conn)  # type: ignore[call-arg]
+        return await conn.fetchval("select count(*) from item")
+
+    @with_db_transaction(savepoint=True)
+    async def inner(self, *, conn: Connection):
+        self.inner_calls += 1
+        await conn.execute("insert into item values (1)")
+        if self.inner_calls == 1:
+            raise self.inner_error("conflict")
+
+
+async def test_savepoint_retries_nested_unit(test_db_pool: Pool):
+    service = NestedService(test_db_pool, inner_error=asyncpg.exceptions.DeadlockDetectedError)
+    # the partial work of the failed inner attempt has been rolled back
+    assert await service.outer() == 1  # type: ignore[call-arg]
+    assert (service.outer_calls, service.inner_calls) == (1, 2)
+    [stats] = service.retry_policy.statistics.snapshot()
+    assert stats.name == "NestedService.inner"
+
+
+async def test_savepoint_leaves_serialization_failures_to_outer_transaction(test_db_pool: Pool):
+    service = NestedService(test_db_pool, inner_error=asyncpg.exceptions.SerializationError)
+    assert await service.outer() == 1  # type: ignore[call-arg]
+    assert (service.outer_calls, service.inner_calls) == (2, 2)
+    [stats] = service.retry_policy.statistics.snapshot()
+    assert stats.name == "NestedService.outer"
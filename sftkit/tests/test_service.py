@@ -0,0 +1,297 @@
+import asyncio
+import logging
+
+import asyncpg
+import pytest
+from fastapi import Request
+
+from sftkit.database import Connection, Database, Pool, create_db_pool
+from sftkit.error import ConnectionBudgetExhausted
+from sftkit.http import HTTPServerConfig, Server
+from sftkit.http._error import try_again_later_exception_handler
+from sftkit.service import ConnectionBudget, Service, memoized, with_db_connection, with_db_transaction
+
+ACQUIRE_TIMEOUT = 0.1
+HTTP_SERVICE_UNAVAILABLE = 503
+
+
+class BudgetService(Service):
+    @with_db_connection
+    async def hold(self, started: asyncio.Event, release: asyncio.Event, *, conn: Connection):
+        del conn
+        started.set()
+        await release.wait()
+
+    @with_db_transaction(read_only=True, budget=ConnectionBudget("report", max_connections=1, acquire_timeout=0.1))
+    async def report(self, started: asyncio.Event, release: asyncio.Event, *, conn: Connection):
+        del conn
+        started.set()
+        await release.wait()
+
+    @with_db_transaction(read_only=True)
+    async def ping(self, *, conn: Connection) -> int:
+        return await conn.fetchval("select 1")
+
+
+async def _hold(method, *args) -> tuple[asyncio.Task, asyncio.Event]:
+    started, release = asyncio.Event(), asyncio.Event()
+    task = asyncio.create_task(method(*args, started, release))
+    await started.wait()
+    return task, release
+
+
+async def test_service_connection_budget(test_db_pool: Pool):
+    budget = ConnectionBudget("budget", max_connections=1, acquire_timeout=ACQUIRE_TIMEOUT)
+    limited = BudgetService(db_pool=test_db_pool, config=None, connection_budget=budget)
+    unlimited = BudgetService(db_pool=test_db_pool, config=None)
+
+    task, release = await _hold(limited.hold)
+    with pytest.raises(ConnectionBudgetExhausted):
+        await limited.ping()  # type: ignore[call-arg]
+    # other services are not affected by the exhausted budget
+    assert await unlimited.ping() == 1  # type: ignore[call-arg]
+    release.set()
+    await task
+    assert await limited.ping() == 1  # type: ignore[call-arg]
+
+
+async def test_method_connection_budget(test_db_pool: Pool):
+    service = BudgetService(db_pool=test_db_pool, config=None)
+
+    task, release = await _hold(service.report)
+    with pytest.raises(ConnectionBudgetExhausted):
+        await service.report(asyncio.Event(), asyncio.Event())  # type: ignore[call-arg]
+    assert await service.ping() == 1  # type: ignore[call-arg]
+    release.set()
+    await task
+
+
+async def test_acquire_timeout_of_exhausted_pool(test_db_pool: Pool):
+    budget = ConnectionBudget("budget", acquire_timeout=ACQUIRE_TIMEOUT)
+    service = BudgetService(db_pool=test_db_pool, config=None, connection_budget=budget)
+    held = [await test_db_pool.acquire() for _ in range(test_db_pool.get_max_size())]
+    try:
+        with pytest.raises(ConnectionBudgetExhausted):
+            await service.ping()  # type: ignore[call-arg]
+    finally:
+        for conn in held:
+            await test_db_pool.release(conn)
+
+
+def test_budget_exhausted_is_service_unavailable():
+    server: Server = Server(
+        title="test",
+        config=HTTPServerConfig(base_url="http://localhost", host="localhost", port=8080),
+        version="1",
+        license_name="MIT",
+    )
+    handler = server.api.exception_handlers[ConnectionBudgetExhausted]
+    assert handler is try_again_later_exception_handler
+    response = try_again_later_exception_handler(
+        Request({"type": "http"}), ConnectionBudgetExhausted("budget", ACQUIRE_TIMEOUT)
+    )
+    assert response.status_code == HTTP_SERVICE_UNAVAILABLE
+
+
+class ReadOnlyFlagService(Service):
+    @with_db_transaction(read_only=True)
+    async def read(self, *, conn: Connection, __read_only__: bool) -> bool:
+        del conn
+        return __read_only__
+
+    @with_db_transaction
+    async def write(self, *, conn: Connection, __read_only__: bool) -> bool:
+        del conn
+        return __read_only__
+
+
+async def test_read_only_flag(test_db_pool: Pool):
+    service = ReadOnlyFlagService(db_pool=test_db_pool, config=None)
+    assert await service.read()  # type: ignore[call-arg]
+    assert not await service.write()  # type: ignore[call-arg]
+    async with test_db_pool.acquire() as conn:
+        assert await service.read(conn=conn)  # type: ignore[call-arg]
+
+
+TRANSACTION_SETTINGS = (
+    "select current_setting('transaction_isolation'), current_setting('transaction_read_only'), "
+    "current_setting('transaction_deferrable')"
+)
+
+
+class ReadOnlyModeService(Service):
+    calls = 0
+
+    @with_db_transaction(read_only=True)
+    async def read_committed(self, *, conn: Connection) -> tuple:
+        return tuple(await conn.fetchrow(TRANSACTION_SETTINGS))
+
+    @with_db_transaction(read_only=True, read_only_mode="snapshot")
+    async def snapshot(self, *, conn: Connection) -> tuple:
+        return tuple(await conn.fetchrow(TRANSACTION_SETTINGS))
+
+    @with_db_transaction(read_only=True, read_only_mode="serializable")
+    async def report(self, *, conn: Connection) -> tuple:
+        return tuple(await conn.fetchrow(TRANSACTION_SETTINGS))
+
+    @with_db_transaction(read_only=True, read_only_mode="snapshot")
+    async def conflicting_snapshot(self, *, conn: Connection):
+        # e.g. cancelled due to a recovery conflict on a replica
+        self.calls += 1
+        if self.calls == 1:
+            raise asyncpg.exceptions.SerializationError("conflict")
+        return await conn.fetchval("select 1")
+
+    @with_db_transaction(read_only=True, read_only_mode="serializable")
+    async def conflicting_report(self, *, conn: Connection):
+        del conn
+        self.calls += 1
+        raise asyncpg.exceptions.SerializationError("conflict")
+
+
+async def test_read_only_modes(test_db_pool: Pool):
+    service = ReadOnlyModeService(db_pool=test_db_pool, config=None)
+    assert await service.read_committed() == ("read committed", "off", "off")  # type: ignore[call-arg]
+    assert await service.snapshot() == ("repeatable read", "on", "off")  # type: ignore[call-arg]
+    assert await service.report() == ("serializable", "on", "on")  # type: ignore[call-arg]
+
+    # snapshot transactions might run on a replica and are retried
+    assert await service.conflicting_snapshot() == 1  # type: ignore[call-arg]
+    assert service.calls == len(["conflict", "retry"])
+
+    # deferrable transactions on the primary are not retried
+    service.calls = 0
+    with pytest.raises(asyncpg.exceptions.SerializationError):
+        await service.conflicting_report()  # type: ignore[call-arg]
+    assert service.calls == 1
+
+    with pytest.raises(ValueError):
+        with_db_transaction(read_only=False, read_only_mode="snapshot")(ReadOnlyModeService.snapshot)
+
+
+class NestingService(Service):
+    @with_db_transaction
+    async def outer(self, *, conn: Connection) -> list[bool]:
+        return [await self.inner() is conn, await self.in_transaction()]  # type: ignore[call-arg]
+
+    @with_db_connection
+    async def outer_without_transaction(self, *, conn: Connection) -> list[bool]:
+        return [await self.inner() is conn, await self.in_transaction()]  # type: ignore[call-arg]
+
+    @with_db_transaction
+    async def outer_with_tasks(self, *, conn: Connection) -> list[bool]:
+        inner = await asyncio.gather(self.inner(), self.inner())  # type: ignore[call-arg]
+        return [c is conn for c in inner]
+
+    @with_db_transaction(read_only=True)
+    async def read_only_outer(self, *, conn: Connection) -> bool:
+        return await self.inner() is conn  # type: ignore[call-arg]
+
+    @with_db_transaction
+    async def inner(self, *, conn: Connection) -> Connection:
+        return conn
+
+    @with_db_transaction
+    async def in_transaction(self, *, conn: Connection) -> bool:
+        # serializable is only set for the outermost transaction
+        return await conn.fetchval("select current_setting('transaction_isolation')") == "serializable"
+
+
+async def test_nested_service_calls_reuse_connection(test_db_pool: Pool):
+    service = NestingService(db_pool=test_db_pool, config=None)
+    assert await service.outer() == [True, True]  # type: ignore[call-arg]
+    assert await service.outer_without_transaction() == [True, True]  # type: ignore[call-arg]
+    # tasks created by a service method do not share its connection
+    assert await service.outer_with_tasks() == [False, False]  # type: ignore[call-arg]
+    # read only connections are not used for writes
+    assert not await service.read_only_outer()  # type: ignore[call-arg]
+
+
+async def test_debug_nested_acquire(test_db: Database, caplog: pytest.LogCaptureFixture):
+    cfg = test_db.config.model_copy(update={"debug_nested_acquire": True})
+    pool = await create_db_pool(cfg, n_connections=2)
+    service = NestingService(db_pool=pool, config=None)
+    try:
+        with caplog.at_level(logging.WARNING, logger="sftkit.database._pool"):
+            await service.outer()  # type: ignore[call-arg]
+            assert caplog.records == []
+            await service.read_only_outer()  # type: ignore[call-arg]
+    finally:
+        await pool.close()
+
+    [record] = caplog.records
+    assert "Nested acquire" in record.getMessage()
+    assert "read_only_outer" in record.getMessage()
+
+
+class MemoService(Service):
+    lookups = 0
+    attempts = 0
+
+    @memoized
+    @with_db_transaction(read_only=True)
+    async def lookup(self, key: str, *, conn: Connection) -> str:
+        self.lookups += 1
+        return await conn.fetchval("select $1::text", key)
+
+    @with_db_transaction
+    async def write(self, *, conn: Connection):
+        del conn
+
+    @with_db_transaction
+    async def write_after_lookup(self, *, conn: Connection):
+        del conn
+        await self.lookup("a")  # type: ignore[call-arg]
+
+    @with_db_transaction
+    async def retried(self, *, conn: Connection) -> str:
+        del conn
+        self.attempts += 1
+        result = await self.lookup("a")  # type: ignore[call-arg]
+        if self.attempts == 1:
+            raise asyncpg.exceptions.SerializationError("conflict")
+        return result
+
+    @with_db_transaction
+    async def request_with_write_lookup(self, *, conn: Connection):
+        del conn
+        await self.write_after_lookup()  # type: ignore[call-arg]
+        await self.lookup("a")  # type: ignore[call-arg]
+
+    @with_db_transaction
+    async def request(self, *, conn: Connection) -> list[str]:
+        del conn
+        results = [await self.lookup("a"), await self.lookup("a"), await self.lookup("b")]  # type: ignore[call-arg]
+        await self.write()  # type: ignore[call-arg]
+        results.append(await self.lookup("a"))  # type: ignore[call-arg]
+        return results
+
+
+async def test_memoized(test_db_pool: Pool):
+    service = MemoService(db_pool=test_db_pool, config=None)
+    assert await service.request() == ["a", "a", "b", "a"]  # type: ignore[call-arg]
+    # the write in between invalidated the memoized lookup of "a"
+    assert service.lookups == len(["a", "b", "a"])
+
+    # results are not kept beyond the enclosing call
+    await service.request()  # type: ignore[call-arg]
+    assert service.lookups == len(["a", "b", "a"]) * 2
+    # without an enclosing call nothing is memoized
+    await service.lookup("a")  # type: ignore[call-arg]
+    await service.lookup("a")  # type: ignore[call-arg]
+    assert service.lookups == len(["a", "b", "a"]) * 2 + 2
+
+
+async def test_memo_cleared_between_attempts(test_db_pool: Pool):
+    service = MemoService(db_pool=test_db_pool, config=None)
+    assert await service.retried() == "a"  # type: ignore[call-arg]
+    # the retry does not reuse the lookup of the failed attempt
+    assert service.attempts == len(["conflict", "retry"])
+    assert service.lookups == len(["conflict", "retry"])
+
+
+async def test_memo_cleared_after_write(test_db_pool: Pool):
+    service = MemoService(db_pool=test_db_pool, config=None)
+    await service.request_with_write_lookup()  # type: ignore[call-arg]
+    # the lookup memoized during the write is not served after it
+    assert service.lookups == len(["during write", "after write"])